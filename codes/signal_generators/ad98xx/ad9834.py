@@ -60,7 +60,7 @@ class AD9834(ad98xx.AD98xx):
 
 
     def enable_comparator(self, value = True):
-        self._action = 'enable_comparator {}'.format(value)
+        self._trace('enable_comparator', value)
         if value:
             self.control_register.elements['OPBITEN'].value = 1
             self.control_register.elements['Mode'].value = 0
@@ -78,7 +78,7 @@ class AD9834(ad98xx.AD98xx):
 
 
     def enable_pin_control(self, value = True):
-        self._action = 'enable_pin_control {}'.format(value)
+        self._trace('enable_pin_control', value)
         self.control_register.elements['PIN_SW'].value = int(bool(value))
         self._update_control_register()
 
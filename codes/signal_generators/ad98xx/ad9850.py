@@ -87,6 +87,7 @@ class AD9850(AD98xx):
     DEBUG_MODE = False
     REGISTERS_COUNT = 1
     FREQ_MCLK = int(125e6)
+    TUNING_WORD_BITS = 32
 
     SHAPES_CONFIG = {'sine': None}
 
@@ -105,7 +106,7 @@ class AD9850(AD98xx):
 
 
     def init(self):
-        self._action = 'init'
+        self._trace('init')
         self.reset()
         self.enable_output(False)
         self.set_frequency(freq = self.frequency, freq_mclk = self.freq_mclk)
@@ -118,7 +119,11 @@ class AD9850(AD98xx):
         raise NotImplementedError()
 
 
-    def write_all_registers(self, reset = False):
+    def _bus_word_address(self, bytes_array):
+        return 0  # a single 40-bit register.
+
+
+    def _write_changed_registers(self, reset = False):
         self._update_control_register(reset = reset)
 
 
@@ -126,19 +131,42 @@ class AD9850(AD98xx):
         self.control_register.print(as_hex = as_hex)
 
 
-    @property
-    def freq_resolution(self):
-        return self.freq_mclk / POW2_32
-
-
     @property
     def phase_resolution(self):
         return DEGREES_IN_PI2 / POW2_5
 
 
+    def frequency_table(self, freqs, idx = None, freq_correction = None, freq_mclk = None, *, phases = None):
+        # tuning words and the 5 bytes written for an array of frequencies, at the current phase by default.
+        assert idx in (None, 0), 'AD9850 has a single frequency register.'
+        try:
+            from .frequency_table import ad9850_table
+        except:
+            from frequency_table import ad9850_table
+
+        return ad9850_table(freqs, self.control_register.phase if phases is None else phases,
+                            self.freq_mclk if freq_mclk is None else freq_mclk,
+                            freq_correction = self.freq_correction if freq_correction is None else freq_correction)
+
+
+    def phase_table(self, phases, idx = None):
+        raise NotImplementedError('AD9850 has a single register holding both frequency and phase, '
+                                  'use frequency_table(freqs, phases = phases).')
+
+
+    def enable_double_buffering(self, value = True):
+        if value:
+            raise NotImplementedError('AD9850 has a single frequency register, there is no inactive one to load.')
+
+
+    def compile_trajectory(self, freqs, sample_rate):
+        raise NotImplementedError('AD9850 has a single frequency register, nothing to ping-pong with; '
+                                  'use frequency_table for pre-encoded words.')
+
+
     def set_frequency(self, freq, freq_correction = None, freq_mclk = None):
         freq = freq + (self.freq_correction if freq_correction is None else freq_correction)
-        self._action = 'set_frequency {}'.format(freq)
+        self._trace('set_frequency', freq)
 
         self.control_register.frequency = freq
         self.control_register.freq_mclk = self.freq_mclk if freq_mclk is None else freq_mclk
@@ -146,18 +174,18 @@ class AD9850(AD98xx):
 
 
     def set_phase(self, phase):
-        self._action = 'set_phase {}'.format(phase)
+        self._trace('set_phase', phase)
         self.control_register.phase = phase
         self._update_control_register()
 
 
     def select_freq_source(self, idx):
-        self._action = 'select_freq_source {}'.format(idx)
+        self._trace('select_freq_source', idx)
         raise NotImplementedError()
 
 
     def select_phase_source(self, idx):
-        self._action = 'select_phase_source {}'.format(idx)
+        self._trace('select_phase_source', idx)
         raise NotImplementedError()
 
 
@@ -193,12 +221,12 @@ class AD9850(AD98xx):
 
     @AD98xx.shape.setter
     def shape(self, shape):
-        self._action = 'set shape {}'.format(shape)
+        self._trace('set_shape', shape)
         self._shape = shape
 
 
     def reset(self):
-        self._action = 'reset'
+        self._trace('reset')
         if self.pin_reset is not None:
             self.pin_reset.high()
             self.pin_reset.low()
@@ -206,7 +234,7 @@ class AD9850(AD98xx):
 
 
     def enable_output(self, value = True):
-        self._action = 'enable_output {}'.format(value)
+        self._trace('enable_output', value)
         self._power_down(not value)
 
 
@@ -216,7 +244,7 @@ class AD9850(AD98xx):
 
 
     def _enable_internal_clock(self, value = True):
-        self._action = '_enable_internal_clock {}'.format(value)
+        self._trace('_enable_internal_clock', value)
         self._power_down(not value)
 
 
@@ -3,9 +3,11 @@
 
 try:
     from ..interfaces import *
+    from ..register_codec import RegisterCodec
     from utilities.register import Register, Element, array
 except:
     from interfaces import *
+    from register_codec import RegisterCodec
     from register import Register, Element, array
 
 FREQ_MCLK = int(25e6)
@@ -79,6 +81,9 @@ class FrequencyRegister(Register):
                          default_value = int((idx + 1) << 14))
         self.idx = idx
         self.freq_mclk = freq_mclk
+        self.half = None  # 'lsw' / 'msw' when only that half is written, with B28 = 0.
+        self._codec = RegisterCodec.of(self)
+        self._index_word = self._codec.pack({'Index': idx + 1})
         self.frequency = freq
 
 
@@ -108,19 +113,33 @@ class FrequencyRegister(Register):
         assert abs(frequency) <= self.freq_mclk // 2, \
             'Must frequency <= freq_mclk // 2 = {}'.format(self.freq_mclk // 2)
         self._frequency = frequency
-        self._value_28_bits = int(round(frequency * POW2_28 / self.freq_mclk)) & 0xFFFFFFF
+        self._value_28_bits = self.word_of(frequency, self.freq_mclk)
+        self.elements['Frequency'].value = self._value_28_bits >> 14  # the word left in the register by a 28-bit write.
+
+
+    @staticmethod
+    def word_of(frequency, freq_mclk):
+        return int(round(frequency * POW2_28 / freq_mclk)) & 0xFFFFFFF
+
+
+    @property
+    def msw_word(self):
+        return self._codec.set(self._index_word, 'Frequency', self._value_28_bits >> 14)
+
+
+    @property
+    def lsw_word(self):
+        return self._codec.set(self._index_word, 'Frequency', self._value_28_bits)
 
 
     @property
     def msw(self):
-        self.elements['Frequency'].value = self._value_28_bits // 0x3FFF
-        return self.bytes
+        return self._codec.to_bytes(self.msw_word)
 
 
     @property
     def lsw(self):
-        self.elements['Frequency'].value = self._value_28_bits & 0x3FFF
-        return self.bytes
+        return self._codec.to_bytes(self.lsw_word)
 
 
 
@@ -143,6 +162,8 @@ class PhaseRegister(Register):
                                              description = '''Phase''')],
                          default_value = int(3 << 14) + int(idx << 13))
         self.idx = idx
+        self._codec = RegisterCodec.of(self)
+        self._index_word = self._codec.pack({'D15': 1, 'D14': 1, 'Index': idx})
         self.phase = phase
 
 
@@ -164,13 +185,27 @@ class PhaseRegister(Register):
     @phase.setter
     def phase(self, phase):
         self._phase = phase
-        self.elements['Phase'].value = int(round((phase % DEGREES_IN_PI2) * POW2_12 / DEGREES_IN_PI2)) & 0xFFF
+        self.elements['Phase'].value = self.word_of(phase)
+
+
+    @staticmethod
+    def word_of(phase):
+        return int(round((phase % DEGREES_IN_PI2) * POW2_12 / DEGREES_IN_PI2)) & 0xFFF
+
+
+    @property
+    def word(self):
+        return self._codec.set(self._index_word, 'Phase', self.elements['Phase'].value)
 
 
 
 class AD98xx(Device):
+    INSTRUMENTED_OPS = Device.INSTRUMENTED_OPS + ('play_trajectory',)
     REGISTERS_COUNT = 2
     FREQ_MCLK = int(25e6)
+    DOUBLE_BUFFERED = False
+    TUNING_WORD_BITS = 28
+    PARTIAL_UPDATES = False  # opt in with enable_partial_updates: B28 = 0 writes make later writes depend on the mode.
 
     SHAPES_CONFIG = {'sine'       : {'OPBITEN': 0, 'SLEEP12': 0, 'Mode': 0, 'DIV2': 0},
                      'triangle'   : {'OPBITEN': 0, 'SLEEP12': 0, 'Mode': 1, 'DIV2': 0},
@@ -190,12 +225,15 @@ class AD98xx(Device):
         self.control_register = ControlRegister()
         self.frequency_registers = {i: FrequencyRegister(idx = i) for i in range(self.REGISTERS_COUNT)}
         self.phase_registers = {i: PhaseRegister(idx = i) for i in range(self.REGISTERS_COUNT)}
+        self._double_buffered = self.DOUBLE_BUFFERED
+        self._partial_updates = self.PARTIAL_UPDATES
 
         self.init()
 
 
     def init(self):
-        self._action = 'init'
+        self._trace('init')
+        self.invalidate_shadow_cache()
         self.enable_output(False)
         for i in range(self.REGISTERS_COUNT):
             self.set_frequency(idx = i, freq = self.frequency, freq_mclk = self.freq_mclk)
@@ -206,31 +244,75 @@ class AD98xx(Device):
         self.start()
 
 
-    def _write_register(self, register, reset = False):
-        super()._write_register(register, reset = reset)
-        return self._bus.write(register.bytes)
+    def _write_bus_raw(self, bytes_array):
+        return self._bus.write(bytes_array)
 
 
-    def _update_control_register(self, reset = False):
-        self._write_register(self.control_register, reset = reset)
+    def _bus_word_address(self, bytes_array):
+        # D15:D14: 0 control, 1 FREQ0, 2 FREQ1, 3 PHASE, with D13 selecting PHASE0 (3) or PHASE1 (4).
+        target = bytes_array[0] >> 6
+        return target + ((bytes_array[0] >> 5) & 0x1) if target == 3 else target
 
 
-    def _update_frequency_register(self, register, reset = False):
-        if reset:
-            register.reset()
+    def _register_value(self, register):
+        if isinstance(register, FrequencyRegister):
+            return register._value_28_bits
+        if isinstance(register, PhaseRegister):
+            return register.word
+        return register.value
+
 
-        self._enable_B28(True)
+    def _register_words(self, register):
+        if isinstance(register, FrequencyRegister):
+            if register.half is not None:
+                return (register.msw if register.half == 'msw' else register.lsw,)
+            return register.lsw, register.msw
+        if isinstance(register, PhaseRegister):
+            return (register._codec.to_bytes(register.word),)
+        return (register.bytes,)
 
-        self._show_bus_data(register.lsw, address = register.address)
-        self._bus.write(register.lsw)
 
-        self._show_bus_data(register.msw, address = register.address)
-        self._bus.write(register.msw)
+    def _update_control_register(self, reset = False):
+        self._write_register(self.control_register, reset = reset)
 
-        self._print_register(register)
 
+    def _update_frequency_register(self, register, reset = False):
+        if reset:
+            register.reset()
 
-    def write_all_registers(self, reset = False):
+        if self._shadow_cache_enabled and self._registers_written.get(register) == register._value_28_bits:
+            return  # already on the chip, whichever mode the control register is in.
+
+        half = self._changed_half(register)
+        register.half = half
+        if half is None:
+            self._enable_B28(True)
+            self._write_register(register)
+        else:
+            # the mode and the word go out together, even within a transaction.
+            self.flush()
+            self.control_register.elements['B28'].value = 0
+            self.control_register.elements['HLB'].value = int(half == 'msw')
+            self._update_control_register()
+            self._write_register(register)
+            self.flush()
+            self._n_stateful_writes += 1
+
+
+    def _changed_half(self, register):
+        # 'lsw' or 'msw' if only that half of the word on the chip changes, else None.
+        if not (self._partial_updates and self._shadow_cache_enabled) or register in self._dirty_registers:
+            return None
+        written = self._registers_written.get(register)
+        if written is None:
+            return None
+        changed = written ^ register._value_28_bits
+        if changed >> 14 and changed & 0x3FFF:
+            return None
+        return 'msw' if changed >> 14 else 'lsw'
+
+
+    def _write_changed_registers(self, reset = False):
         self._update_control_register(reset = reset)
         for i in range(self.REGISTERS_COUNT):
             self._update_frequency_register(self.frequency_registers[i], reset = reset)
@@ -238,7 +320,7 @@ class AD98xx(Device):
 
 
     def print(self, as_hex = False):
-        self._action = 'print'
+        self._trace('print')
         self.control_register.print(as_hex = as_hex)
         for i in range(self.REGISTERS_COUNT):
             self.frequency_registers[i].print(as_hex = as_hex)
@@ -247,7 +329,7 @@ class AD98xx(Device):
 
     @property
     def freq_resolution(self):
-        return self.freq_mclk / POW2_28
+        return self.freq_mclk / 2 ** self.TUNING_WORD_BITS
 
 
     @property
@@ -255,35 +337,117 @@ class AD98xx(Device):
         return DEGREES_IN_PI2 / POW2_12
 
 
+    def quantize_frequencies(self, freqs):
+        # tuning words for an array of frequencies, and the frequencies they actually produce.
+        try:
+            from .frequency_table import tuning_words, frequencies_of
+        except:
+            from frequency_table import tuning_words, frequencies_of
+
+        n_bits = self.TUNING_WORD_BITS
+        words = tuning_words(freqs, self.freq_mclk, freq_correction = self.freq_correction, n_bits = n_bits)
+        return words, frequencies_of(words, self.freq_mclk, freq_correction = self.freq_correction, n_bits = n_bits)
+
+
+    def frequency_table(self, freqs, idx = None, freq_correction = None, freq_mclk = None):
+        # tuning words and LSW / MSW bus words of FREQ<idx> for an array of frequencies.
+        try:
+            from .frequency_table import frequency_table
+        except:
+            from frequency_table import frequency_table
+
+        return frequency_table(freqs, self.active_freq_reg_idx if idx is None else idx,
+                               self.freq_mclk if freq_mclk is None else freq_mclk,
+                               freq_correction = self.freq_correction if freq_correction is None else freq_correction)
+
+
+    def phase_table(self, phases, idx = None):
+        try:
+            from .frequency_table import phase_table
+        except:
+            from frequency_table import phase_table
+
+        return phase_table(phases, self.active_phase_reg_idx if idx is None else idx)
+
+
+    def compile_trajectory(self, freqs, sample_rate):
+        # a frequency per sample, pre-encoded for play_trajectory.
+        try:
+            from .trajectory import Trajectory
+        except:
+            from trajectory import Trajectory
+
+        return Trajectory.compile(self, freqs, sample_rate)
+
+
+    def play_trajectory(self, trajectory, scheduler = None):
+        self._trace('play_trajectory', len(trajectory), trajectory.sample_rate)
+        return trajectory.play(self, scheduler = scheduler)
+
+
     def set_frequency(self, freq, idx = None, freq_correction = None, freq_mclk = None):
         freq = freq + (self.freq_correction if freq_correction is None else freq_correction)
-        idx = self.active_freq_reg_idx if idx is None else idx
         freq_mclk = self.freq_mclk if freq_mclk is None else freq_mclk
-        self._action = 'set_frequency {} idx {}'.format(freq, idx)
+        flip = idx is None and self._double_buffered and \
+               FrequencyRegister.word_of(freq, freq_mclk) != self.current_frequency_register._value_28_bits
+        idx = (self.active_freq_reg_idx ^ flip) if idx is None else idx
+        self._trace('set_frequency', freq, idx)
 
         freq_reg = self.frequency_registers[idx]
+        freq_reg.freq_mclk = freq_mclk  # before the frequency, which is converted with it.
         freq_reg.frequency = freq
-        freq_reg.freq_mclk = freq_mclk
         self._update_frequency_register(freq_reg)
 
+        if flip:
+            self.flush()  # the bank must be loaded before it is selected, also within a transaction.
+            self.select_freq_source(idx)
+            self._n_stateful_writes += 1
+
 
     def set_phase(self, phase, idx = None):
-        idx = self.active_phase_reg_idx if idx is None else idx
-        self._action = 'set_phase {} idx {}'.format(phase, idx)
+        flip = idx is None and self._double_buffered and \
+               PhaseRegister.word_of(phase) != self.current_phase_register.elements['Phase'].value
+        idx = (self.active_phase_reg_idx ^ flip) if idx is None else idx
+        self._trace('set_phase', phase, idx)
 
         phase_reg = self.phase_registers[idx]
         phase_reg.phase = phase
         self._write_register(phase_reg)
 
+        if flip:
+            self.flush()
+            self.select_phase_source(idx)
+            self._n_stateful_writes += 1
+
+
+    def enable_double_buffering(self, value = True):
+        # set_frequency / set_phase without idx load the register not in use, then select it with one control write.
+        self._double_buffered = bool(value)
+
+
+    @property
+    def double_buffered(self):
+        return self._double_buffered
+
+
+    def enable_partial_updates(self, value = True):
+        # a frequency change within the 14 LSBs or the 14 MSBs is written as that half only, with B28 = 0.
+        self._partial_updates = bool(value)
+
+
+    @property
+    def partial_updates(self):
+        return self._partial_updates
+
 
     def select_freq_source(self, idx):
-        self._action = 'select_freq_source {}'.format(idx)
+        self._trace('select_freq_source', idx)
         self.control_register.elements['FSELECT'].value = idx & 0x1
         self._update_control_register()
 
 
     def select_phase_source(self, idx):
-        self._action = 'select_phase_source {}'.format(idx)
+        self._trace('select_phase_source', idx)
         self.control_register.elements['PSELECT'].value = idx
         self._update_control_register()
 
@@ -320,7 +484,7 @@ class AD98xx(Device):
 
     @Device.shape.setter
     def shape(self, shape):
-        self._action = 'set shape {}'.format(shape)
+        self._trace('set_shape', shape)
         assert shape in self.SHAPES_CONFIG.keys(), 'Must be either {}'.format('/'.join(self.SHAPES_CONFIG.keys()))
         self._shape = shape
         for k in self.SHAPES_CONFIG[shape].keys():
@@ -332,31 +496,33 @@ class AD98xx(Device):
         freq = self.frequency if freq is None else freq
         phase = self.phase if phase is None else phase
         shape = self.shape if shape is None else shape
-        self._action = 'apply_signal freq={} phase={} shape={}'.format(freq, phase, shape)
+        self._trace('apply_signal', freq, phase, shape)
 
-        self.set_frequency(freq = freq, freq_correction = freq_correction, freq_mclk = freq_mclk)
-        self.set_phase(phase = phase)
-        self.shape = shape
+        with self.transaction():
+            self.set_frequency(freq = freq, freq_correction = freq_correction, freq_mclk = freq_mclk)
+            self.set_phase(phase = phase)
+            self.shape = shape
 
 
     def enable(self, value = True):
-        self._action = 'enable {}'.format(value)
+        self._trace('enable', value)
         self._enabled = value
-        if value:
-            self.shape = self.shape  # restore bit SLEEP12 according to shape.
-        self._enable_internal_clock(value)
-        self.enable_output(value)
+        with self.transaction():
+            if value:
+                self.shape = self.shape  # restore bit SLEEP12 according to shape.
+            self._enable_internal_clock(value)
+            self.enable_output(value)
 
 
     def enable_output(self, value = True):
-        self._action = 'enable_output: {}'.format(value)
+        self._trace('enable_output', value)
         self.control_register.elements['Reset'].value = int(not bool(value))
         self._update_control_register()
 
 
 
     def stop(self):
-        self._action = 'stop'
+        self._trace('stop')
         self._enable_DAC(False)
         self.pause()
 
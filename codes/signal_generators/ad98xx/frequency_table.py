@@ -0,0 +1,86 @@
+import numpy as np
+
+try:
+    from .ad98xx import DEGREES_IN_PI2
+except:
+    from ad98xx import DEGREES_IN_PI2
+
+FREQUENCY_TABLE_DTYPE = np.dtype([('freq', '<f8'),
+                                  ('word', '<u4'),
+                                  ('lsw', '<u2'),
+                                  ('msw', '<u2')])
+
+PHASE_TABLE_DTYPE = np.dtype([('phase', '<f8'),
+                              ('word', '<u2'),
+                              ('bus_word', '<u2')])
+
+AD9850_TABLE_DTYPE = np.dtype([('freq', '<f8'),
+                               ('word', '<u4'),
+                               ('bytes', 'u1', (5,))])
+
+
+
+def tuning_words(freqs, freq_mclk, freq_correction = 0, n_bits = 28):
+    # same rounding as FrequencyRegister.frequency, for a whole array.
+    freqs = np.asarray(freqs, dtype = np.float64) + freq_correction
+    assert (np.abs(freqs) <= freq_mclk // 2).all(), 'Must frequency <= freq_mclk // 2 = {}'.format(freq_mclk // 2)
+    return np.round(freqs * (2 ** n_bits) / freq_mclk).astype(np.int64) & ((1 << n_bits) - 1)
+
+
+
+def frequencies_of(words, freq_mclk, freq_correction = 0, n_bits = 28):
+    return np.asarray(words, dtype = np.int64) * freq_mclk / (2 ** n_bits) - freq_correction
+
+
+
+def phase_words(phases, n_bits = 12):
+    # same rounding as PhaseRegister.phase, for a whole array.
+    phases = np.asarray(phases, dtype = np.float64) % DEGREES_IN_PI2
+    return np.round(phases * (2 ** n_bits) / DEGREES_IN_PI2).astype(np.int64) & ((1 << n_bits) - 1)
+
+
+
+def frequency_bus_words(words, idx):
+    # the LSW then MSW 16-bit writes loading FREQ<idx> with B28 = 1.
+    words = np.asarray(words, dtype = np.int64)
+    index = (idx + 1) << 14
+    return (index | (words & 0x3FFF)).astype('<u2'), (index | ((words >> 14) & 0x3FFF)).astype('<u2')
+
+
+
+def phase_bus_words(words, idx):
+    return (0xC000 | (idx << 13) | (np.asarray(words, dtype = np.int64) & 0xFFF)).astype('<u2')
+
+
+
+def frequency_table(freqs, idx, freq_mclk, freq_correction = 0):
+    freqs = np.asarray(freqs, dtype = np.float64)
+    table = np.zeros(freqs.shape, dtype = FREQUENCY_TABLE_DTYPE)
+    table['freq'] = freqs
+    table['word'] = tuning_words(freqs, freq_mclk, freq_correction = freq_correction, n_bits = 28)
+    table['lsw'], table['msw'] = frequency_bus_words(table['word'], idx)
+    return table
+
+
+
+def phase_table(phases, idx):
+    phases = np.asarray(phases, dtype = np.float64)
+    table = np.zeros(phases.shape, dtype = PHASE_TABLE_DTYPE)
+    table['phase'] = phases
+    table['word'] = phase_words(phases, n_bits = 12)
+    table['bus_word'] = phase_bus_words(table['word'], idx)
+    return table
+
+
+
+def ad9850_table(freqs, phases, freq_mclk, freq_correction = 0, power_down = False):
+    # 40-bit words sent LSB first: W0..W3 frequency, then power down and 5 phase bits.
+    freqs = np.asarray(freqs, dtype = np.float64)
+    table = np.zeros(freqs.shape, dtype = AD9850_TABLE_DTYPE)
+    table['freq'] = freqs
+    table['word'] = tuning_words(freqs, freq_mclk, freq_correction = freq_correction, n_bits = 32)
+
+    words = table['word'].astype(np.uint64) | (np.uint64(bool(power_down)) << np.uint64(34)) | \
+            (np.broadcast_to(phase_words(phases, n_bits = 5), freqs.shape).astype(np.uint64) << np.uint64(35))
+    table['bytes'] = words.astype('<u8').view(np.uint8).reshape(freqs.shape + (8,))[..., :5]
+    return table
@@ -0,0 +1,129 @@
+import numpy as np
+
+try:
+    from .frequency_table import tuning_words, frequencies_of
+    from ..register_codec import RegisterCodec
+    from ..scheduler import SymbolScheduler, NS_PER_S
+except:
+    from frequency_table import tuning_words, frequencies_of
+    from register_codec import RegisterCodec
+    from scheduler import SymbolScheduler, NS_PER_S
+
+WORDS_PER_STEP = 3  # LSW, MSW of the inactive FREQ register, then the control word selecting it.
+
+
+
+def linear_chirp(freq_start, freq_end, duration, sample_rate):
+    t = np.arange(int(round(duration * sample_rate))) / sample_rate
+    return freq_start + (freq_end - freq_start) * t / duration
+
+
+
+def exponential_chirp(freq_start, freq_end, duration, sample_rate):
+    t = np.arange(int(round(duration * sample_rate))) / sample_rate
+    return freq_start * (freq_end / freq_start) ** (t / duration)
+
+
+
+def fm(baseband, freq_carrier, deviation):
+    # baseband in [-1, 1].
+    return freq_carrier + deviation * np.asarray(baseband, dtype = np.float64)
+
+
+
+class Trajectory:
+    # a frequency per sample, pre-encoded as ping-pong updates of FREQ0 / FREQ1:
+    # each step loads the register not in use and then selects it, so the output never shows a half written word.
+
+    def __init__(self, freqs, sample_rate, words, step_starts, banks, control_word):
+        self.freqs = freqs  # frequencies actually produced.
+        self.sample_rate = sample_rate
+        self.words = words  # uint16, WORDS_PER_STEP per step that changes the tuning word.
+        self.step_starts = step_starts  # step k writes words[step_starts[k]:step_starts[k + 1]].
+        self.banks = banks  # FREQ register selected after each step.
+        self.control_word = control_word
+
+
+    def __len__(self):
+        return len(self.freqs)
+
+
+    @property
+    def duration(self):
+        return len(self) / self.sample_rate
+
+
+    @property
+    def deadlines_ns(self):
+        return np.round(np.arange(len(self)) * (NS_PER_S / self.sample_rate)).astype(np.int64)
+
+
+    @classmethod
+    def compile(cls, device, freqs, sample_rate):
+        freq_correction = device.freq_correction
+        words_28 = tuning_words(freqs, device.freq_mclk, freq_correction = freq_correction)
+        n = len(words_28)
+
+        # samples repeating the previous tuning word write nothing and keep the bank.
+        changed = np.ones(n, dtype = bool)
+        changed[1:] = words_28[1:] != words_28[:-1]
+        n_changes = np.cumsum(changed)
+        banks = (device.active_freq_reg_idx ^ (n_changes & 1)).astype(np.uint8)
+
+        codec = RegisterCodec.of(device.control_register)
+        control_word = codec.set(codec.set(device.control_register.value, 'B28', 1), 'Reset', 0)
+        control_words = np.array([codec.set(control_word, 'FSELECT', i) for i in (0, 1)], dtype = np.uint16)
+
+        written = words_28[changed]
+        written_banks = banks[changed].astype(np.int64)
+        index = (written_banks + 1) << 14
+        words = np.empty((len(written), WORDS_PER_STEP), dtype = np.uint16)
+        words[:, 0] = index | (written & 0x3FFF)
+        words[:, 1] = index | ((written >> 14) & 0x3FFF)
+        words[:, 2] = control_words[written_banks]
+
+        step_starts = np.zeros(n + 1, dtype = np.int64)
+        step_starts[1:] = n_changes * WORDS_PER_STEP
+
+        return cls(frequencies_of(words_28, device.freq_mclk, freq_correction = freq_correction), sample_rate,
+                   words.ravel(), step_starts, banks, control_word)
+
+
+    def play(self, device, scheduler = None):
+        scheduler = SymbolScheduler() if scheduler is None else scheduler
+        write = device._bus_writer()
+        buffer = memoryview(self.words.astype('>u2').tobytes())
+        step_starts = self.step_starts.tolist()
+
+
+        def emit(k):
+            for i in range(2 * step_starts[k], 2 * step_starts[k + 1], 2):
+                write(buffer[i:i + 2])
+
+
+        device._enable_B28(True)
+        try:
+            scheduler.run_at(self.deadlines_ns.tolist(), int(self.duration * NS_PER_S), emit)
+        except KeyboardInterrupt:
+            print('User interrupts.')
+
+        device._drain_bus_worker()
+        self._sync(device, len(scheduler.errors_ns))
+        return scheduler.stats()
+
+
+    def _sync(self, device, n_played):
+        # leaves the driver's registers as the chip has them after the last played step.
+        if n_played == 0:
+            return
+
+        elements = device.control_register.elements
+        elements['B28'].value = 1
+        elements['Reset'].value = 0
+        elements['FSELECT'].value = int(self.banks[n_played - 1])
+        for bank in (0, 1):
+            played = np.flatnonzero(self.banks[:n_played] == bank)
+            last = played[-1] if len(played) else None
+            if last is not None:
+                device.frequency_registers[bank].frequency = self.freqs[last] + device.freq_correction
+        device.invalidate_shadow_cache()
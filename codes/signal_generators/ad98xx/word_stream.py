@@ -0,0 +1,153 @@
+import json
+import struct
+
+import numpy as np
+
+try:
+    from ..scheduler import SymbolScheduler
+except:
+    from scheduler import SymbolScheduler
+
+
+
+class WordStream:
+    # pre-encoded 16-bit AD9833 / AD9834 bus words with their timing, in a file that is memory mapped on load.
+    # layout: MAGIC, header length ('<I'), JSON header padded to HEADER_ALIGNMENT,
+    # then deadlines_ns ('<i8', n_steps), step_starts ('<i8', n_steps + 1) and words ('>u2', n_words).
+    MAGIC = b'AD98WSTR'
+    HEADER_ALIGNMENT = 16
+    WORD_DTYPE = np.dtype('>u2')  # the order the bytes go on the bus, so words are written without conversion.
+    INDEX_DTYPE = np.dtype('<i8')
+
+
+    def __init__(self, words, step_starts, deadlines_ns, end_ns, n_prologue = 0, n_epilogue = 0,
+                 device = None, freq_mclk = None):
+        self.words = words  # prologue, then the words of every step, then epilogue.
+        self.step_starts = step_starts  # step k writes words[step_starts[k]:step_starts[k + 1]].
+        self.deadlines_ns = deadlines_ns
+        self.end_ns = end_ns
+        self.n_prologue = n_prologue
+        self.n_epilogue = n_epilogue
+        self.device = device
+        self.freq_mclk = freq_mclk
+
+
+    def __len__(self):
+        return len(self.deadlines_ns)
+
+
+    @property
+    def n_words(self):
+        return len(self.words)
+
+
+    @property
+    def config(self):
+        return {'end_ns'    : int(self.end_ns),
+                'n_prologue': int(self.n_prologue),
+                'n_epilogue': int(self.n_epilogue),
+                'device'    : self.device,
+                'freq_mclk' : self.freq_mclk}
+
+
+    @staticmethod
+    def _device_config(device):
+        return {'device': type(device).__name__, 'freq_mclk': device.freq_mclk}
+
+
+    @classmethod
+    def from_plan(cls, plan, device = None):
+        # a modulators.TransmissionPlan.
+        assert all(len(w) == 2 for w in plan.words), 'Only 16-bit bus words can be streamed.'
+        table = np.array([int.from_bytes(bytes(w), 'big') for w in plan.words], dtype = np.uint32)
+
+        words = table[np.concatenate((np.asarray(plan.prologue, dtype = np.int64),
+                                      np.asarray(plan.word_ids, dtype = np.int64),
+                                      np.asarray(plan.epilogue, dtype = np.int64)))].astype(cls.WORD_DTYPE)
+        step_starts = np.asarray(plan.step_starts, dtype = cls.INDEX_DTYPE) + len(plan.prologue)
+
+        return cls(words, step_starts, np.asarray(plan.deadlines_ns, dtype = cls.INDEX_DTYPE), plan.end_ns,
+                   n_prologue = len(plan.prologue), n_epilogue = len(plan.epilogue),
+                   **({} if device is None else cls._device_config(device)))
+
+
+    @classmethod
+    def compile(cls, modulator, sequence):
+        return cls.from_plan(modulator.compile(sequence), device = modulator._device)
+
+
+    @classmethod
+    def from_trajectory(cls, trajectory, device = None):
+        # an ad98xx.trajectory.Trajectory; the prologue is its control word, setting B28 = 1 as its play() does.
+        words = np.concatenate(([trajectory.control_word], trajectory.words)).astype(cls.WORD_DTYPE)
+        return cls(words, trajectory.step_starts.astype(cls.INDEX_DTYPE) + 1,
+                   trajectory.deadlines_ns.astype(cls.INDEX_DTYPE), int(round(trajectory.duration * 1e9)),
+                   n_prologue = 1, **({} if device is None else cls._device_config(device)))
+
+
+    def save(self, path):
+        header = json.dumps(dict(self.config, n_steps = len(self), n_words = self.n_words)).encode()
+        len_header = len(self.MAGIC) + 4 + len(header)
+        header += b' ' * (-len_header % self.HEADER_ALIGNMENT)
+
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            f.write(np.ascontiguousarray(self.deadlines_ns, dtype = self.INDEX_DTYPE).tobytes())
+            f.write(np.ascontiguousarray(self.step_starts, dtype = self.INDEX_DTYPE).tobytes())
+            f.write(np.ascontiguousarray(self.words, dtype = self.WORD_DTYPE).tobytes())
+
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            assert f.read(len(cls.MAGIC)) == cls.MAGIC, '{} is not a word stream file.'.format(path)
+            len_header, = struct.unpack('<I', f.read(4))
+            config = json.loads(f.read(len_header).decode())
+
+        n_steps = config.pop('n_steps')
+        n_words = config.pop('n_words')
+        offset = len(cls.MAGIC) + 4 + len_header
+        arrays = []
+        for (dtype, n) in ((cls.INDEX_DTYPE, n_steps), (cls.INDEX_DTYPE, n_steps + 1), (cls.WORD_DTYPE, n_words)):
+            arrays.append(np.memmap(path, dtype = dtype, mode = 'r', offset = offset, shape = (n,)) if n
+                          else np.zeros(0, dtype = dtype))
+            offset += n * dtype.itemsize
+
+        deadlines_ns, step_starts, words = arrays
+        return cls(words, step_starts, deadlines_ns, **config)
+
+
+    def play(self, target, scheduler = None):
+        # target is a device, written through its bus worker when one is attached, or anything with a write(bytes) method.
+        if self.freq_mclk is not None and hasattr(target, 'freq_mclk'):
+            assert target.freq_mclk == self.freq_mclk, \
+                'Stream was compiled for MCLK {}, device has {}.'.format(self.freq_mclk, target.freq_mclk)
+
+        scheduler = SymbolScheduler() if scheduler is None else scheduler
+        write = target._bus_writer() if hasattr(target, '_bus_writer') else target.write
+        buffer = memoryview(np.ascontiguousarray(self.words, dtype = self.WORD_DTYPE).view(np.uint8))
+        step_starts = self.step_starts
+
+
+        def emit(k):
+            for i in range(2 * int(step_starts[k]), 2 * int(step_starts[k + 1]), 2):
+                write(buffer[i:i + 2])
+
+
+        for i in range(0, 2 * self.n_prologue, 2):
+            write(buffer[i:i + 2])
+
+        try:
+            scheduler.run_at(self.deadlines_ns, self.end_ns, emit)
+        except KeyboardInterrupt:
+            print('User interrupts.')
+
+        for i in range(2 * (self.n_words - self.n_epilogue), 2 * self.n_words, 2):
+            write(buffer[i:i + 2])
+
+        if hasattr(target, '_bus_writer'):
+            target._drain_bus_worker()
+            target.invalidate_shadow_cache()
+        return scheduler.stats()
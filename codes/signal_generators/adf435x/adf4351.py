@@ -3,10 +3,10 @@
 
 try:
     from ..interfaces import *
-    from .registers_map import _get_registers_map, array
+    from .registers_map import _clone_registers_map, _load_descriptions, _get_registers_codecs, array
 except:
     from interfaces import *
-    from registers_map import _get_registers_map, array
+    from registers_map import _clone_registers_map, _load_descriptions, _get_registers_codecs, array
 
 
 
@@ -27,6 +27,8 @@ def _freq_trim(n):
 
 class ADF4351(Device):
     FREQ_MCLK = int(25e6)
+    INSTRUMENTED_OPS = Device.INSTRUMENTED_OPS + ('set_frequency_fast',)
+    BUS_IO_METHODS = Device.BUS_IO_METHODS + ('_release_bus_queue',)
     DEFAULT_REGISTERS_VALUES = (0x3C0000, 0x80087D1, 0x30041C2, 0xE404B3, 0x932224, 0X580005)
 
 
@@ -73,7 +75,7 @@ class ADF4351(Device):
 
 
         def set_frequency(self, freq):
-            self._adf._action = 'set_frequency {}'.format(freq)
+            self._adf._trace('set_frequency', freq)
             d = self.source.freq / freq
             self._set_divider(d)
             return True
@@ -85,7 +87,7 @@ class ADF4351(Device):
 
 
         def restore_frequency(self):
-            self._adf._action = 'restore_frequency'
+            self._adf._trace('restore_frequency')
             self.set_frequency(self._frequency)
 
 
@@ -898,7 +900,7 @@ class ADF4351(Device):
                     self._adf.vco.set_frequency(freq_vco)
                     _ = self._adf.rf_n_divider.freq  # validate
 
-                    self._adf.write_all_registers()
+                    self._adf._write_changed_registers()
                     return True
 
                 except AssertionError as e:
@@ -1086,7 +1088,7 @@ class ADF4351(Device):
             # To operate with PFD frequencies higher than 45 MHz, VCO band select must be disabled by
             # setting the phase adjust bit (DB28) to 1 in Register 1.
             if freq > self.FREQUENCY_PFD_MAX_HALF:
-                assert not self._adf.vco.band_select_enabled, \
+                assert not self._adf.band_select_clock_divider.band_select_enabled, \
                     'PFD frequencies is higher than 45 MHz, VCO band select must be disabled'
 
             return freq
@@ -1492,7 +1494,7 @@ class ADF4351(Device):
                  registers_map = None, registers_values = None,
                  commands = None):
 
-        registers_map = _get_registers_map() if registers_map is None else registers_map
+        registers_map = _clone_registers_map() if registers_map is None else registers_map
 
         super().__init__(freq = freq, freq_correction = freq_correction, phase = phase, shape = shape,
                          registers_map = registers_map, registers_values = registers_values,
@@ -1500,12 +1502,15 @@ class ADF4351(Device):
 
         self._bus = bus
         self._register_write_enabled = False
+        self._frequency_plan = None
+        self.codecs = _get_registers_codecs(self.map)
         self.freq_mclk = freq_mclk
         self.init()
 
 
     def init(self):
-        self._action = 'init'
+        self._trace('init')
+        self.invalidate_shadow_cache()
 
         self._build()
         self.write_all_registers()
@@ -1547,29 +1552,89 @@ class ADF4351(Device):
 
 
     def reset(self):
-        self._action = 'reset'
+        self._trace('reset')
         self.init()
 
 
+    def print(self, as_hex = False):
+        self._trace('print')
+        _load_descriptions(self.map).print(as_hex)
+
+
     @property
     def freq_pfd(self):
         return self.ref_divider.freq
 
 
     def apply_signal(self, freq, phase = 0):
-        self.set_frequency(freq)
-        self.set_phase(phase)
+        with self.transaction():
+            self.set_frequency(freq)
+            self.set_phase(phase)
 
 
     def set_channel_resolution(self, resolution = None):
-        self.rf_n_divider._set_channel_resolution(resolution)
+        with self.transaction():
+            self.rf_n_divider._set_channel_resolution(resolution)
 
 
     def set_frequency(self, freq, channel_resolution = None, rf_divider_as = None):
-        self._action = 'set_frequency {}'.format(freq)
-        self.rf_out.set_frequency(freq,
-                                  channel_resolution = channel_resolution,
-                                  rf_divider_as = rf_divider_as)
+        self._trace('set_frequency', freq)
+        with self.transaction():
+            self.rf_out.set_frequency(freq,
+                                      channel_resolution = channel_resolution,
+                                      rf_divider_as = rf_divider_as)
+
+
+    def plan_frequencies(self, freqs, channel_resolution = None):
+        try:
+            from .frequency_plan import FrequencyPlan, plan_frequencies
+        except:
+            from frequency_plan import FrequencyPlan, plan_frequencies
+
+        config = FrequencyPlan.config_of(self)
+        if channel_resolution is not None:
+            config['channel_resolution'] = channel_resolution
+        return plan_frequencies(freqs, **config)
+
+
+    def quantize_frequencies(self, freqs, channel_resolution = None):
+        # a key per distinct (RF divider, INT, FRAC, MOD) setting, and the frequencies they actually produce.
+        plans = self.plan_frequencies(freqs, channel_resolution = channel_resolution)
+        if not plans['valid'].all():
+            raise ValueError('Failed in planning frequencies {}.'.format(plans['freq'][~plans['valid']]))
+
+        keys = plans['rf_divider'].astype('<i8') << 48 | plans['INT'].astype('<i8') << 32 | \
+               plans['FRAC'].astype('<i8') << 16 | plans['MOD']
+        return keys, plans['freq_achieved']
+
+
+    def use_frequency_plan(self, plan):
+        for k, v in plan.config_of(self).items():
+            assert plan.config[k] == v, 'Frequency plan {} is {}, device is {}.'.format(k, plan.config[k], v)
+        self._frequency_plan = plan
+
+
+    def set_frequency_fast(self, freq, tolerance_hz = 1):
+        self._trace('set_frequency_fast', freq)
+        assert self._frequency_plan is not None, 'Call use_frequency_plan() first.'
+        self._apply_frequency_plan(*self._frequency_plan.lookup(freq, tolerance_hz = tolerance_hz))
+
+
+    def _apply_frequency_plan(self, d_rf_divider, INT, FRAC, MOD, prescaler):
+        with self.transaction():
+            self._write_element_by_name('RF_Divider_Select', self.rf_divider.DIVIDER_CODES[d_rf_divider])
+            self.rf_n_divider._set_prescaler(prescaler)
+            self._write_element_by_name('MOD', MOD)
+            self._write_element_by_name('INT', INT)
+            self._write_element_by_name('FRAC', FRAC)
+            self.rf_n_divider._set_integer_mode(FRAC == 0)
+
+            self.rf_divider._divider = d_rf_divider
+            self.rf_n_divider._denominator = MOD
+            self.rf_n_divider._divider = self.rf_n_divider.divider
+            self.vco._set_divider(self.rf_n_divider.divider_equivalent)
+
+            self._confirm_double_buffer()
 
 
     @property
@@ -1584,11 +1649,12 @@ class ADF4351(Device):
     def set_dividers(self, d_ref_doubler = 2, d_r_counter = 1, d_ref_divider = 2,
                      d_rf_n_divider = 120, d_rf_divider = 2):
 
-        self.ref_doubler._set_divider(d_ref_doubler)
-        self.r_counter._set_divider(d_r_counter)
-        self.ref_divider._set_divider(d_ref_divider)
-        self.rf_divider._set_divider(d_rf_divider)
-        self.rf_n_divider._set_divider(d_rf_n_divider)
+        with self.transaction():
+            self.ref_doubler._set_divider(d_ref_doubler)
+            self.r_counter._set_divider(d_r_counter)
+            self.ref_divider._set_divider(d_ref_divider)
+            self.rf_divider._set_divider(d_rf_divider)
+            self.rf_n_divider._set_divider(d_rf_n_divider)
 
 
     @property
@@ -1602,8 +1668,9 @@ class ADF4351(Device):
 
 
     def set_phase(self, phase):
-        self._action = 'set_phase {}'.format(phase)
-        self.phaser.set_phase(phase)
+        self._trace('set_phase', phase)
+        with self.transaction():
+            self.phaser.set_phase(phase)
 
 
     @property
@@ -1617,9 +1684,10 @@ class ADF4351(Device):
 
 
     def enable_output(self, value = True):
-        self._action = 'enable_output: {}'.format(value)
-        self._power_down(not value)
-        self._enable_counters(value)
+        self._trace('enable_output', value)
+        with self.transaction():
+            self._power_down(not value)
+            self._enable_counters(value)
 
 
     @property
@@ -1653,44 +1721,28 @@ class ADF4351(Device):
                                 ref_doubled_by_2 = True, ref_divided_by_2 = True,
                                 rf_divider_as = None,
                                 torance_hz = 1):
-
-        self._register_write_enabled = False
-
-        results = []
-
-        self.mclk.set_frequency(freq_ref)
-
-        for d_ref_doubler in (2,) if ref_doubled_by_2 else self._ReferenceDoubler.DIVIDERS:
-            for d_ref_divider in (2,) if ref_divided_by_2 else self._ReferenceDivider.DIVIDERS:
-                for d_r_counter in range(1, self.r_counter._divider_max + 1):
-                    for d_rf_divider in self.rf_divider.DIVIDERS if rf_divider_as is None else (rf_divider_as,):
-
-                        try:
-                            self.ref_doubler._set_divider(d_ref_doubler)
-                            self.r_counter._set_divider(d_r_counter)
-                            self.ref_divider._set_divider(d_ref_divider)
-                            self.rf_divider._set_divider(d_rf_divider)
-
-                            self.vco.set_frequency(freq_desired * d_rf_divider)
-                            freq_rf_out = self.rf_out.freq  # validate
-
-                            diff = abs(freq_rf_out - freq_desired)
-                            d_rf_n_divider = self.rf_n_divider.divider
-
-                            if diff < torance_hz and _is_integer(d_rf_n_divider):
-
-                                match = ((d_ref_doubler, d_r_counter, d_ref_divider, d_rf_n_divider, d_rf_divider),
-                                         (self.mclk.freq, self.ref_doubler.freq, self.r_counter.freq,
-                                          self.ref_divider.freq,
-                                          self.vco.freq, self.rf_divider.freq, self.rf_out.freq))
-
-                                results.append(match)
-                        except:
-                            pass
-
-            self.init()
-
-        return sorted(results)
+        try:
+            from .frequency_plan import find_integer_n_plans
+        except:
+            from frequency_plan import find_integer_n_plans
+
+        plans = find_integer_n_plans(freq_desired, freq_ref,
+                                     ref_doubled_by_2 = ref_doubled_by_2,
+                                     ref_divided_by_2 = ref_divided_by_2,
+                                     rf_dividers = None if rf_divider_as is None else (rf_divider_as,),
+                                     tolerance_hz = torance_hz,
+                                     prescaler = self.rf_n_divider.prescaler,
+                                     fundamental_feedback = self.rf_n_divider.fundamental_as_feedback,
+                                     band_select_enabled = self.band_select_clock_divider.band_select_enabled,
+                                     cycle_slip_reduction = self.phase_frequency_detector.cycle_slip_reduction_enabled,
+                                     low_spur_mode = self.noise_control.mode == 'LOW_SPUR_MODE')
+
+        return [((int(p['d_ref_doubler']), int(p['d_r_counter']), int(p['d_ref_divider']),
+                  int(p['d_rf_n_divider']), int(p['d_rf_divider'])),
+                 (freq_ref, freq_ref * int(p['d_ref_doubler']),
+                  freq_ref * int(p['d_ref_doubler']) / int(p['d_r_counter']),
+                  float(p['freq_pfd']), float(p['freq_vco']), float(p['freq_achieved']), float(p['freq_achieved'])))
+                for p in plans]
 
 
     # =================================================================
@@ -1731,21 +1783,55 @@ class ADF4351(Device):
 
     # =================================================================
 
-    def _write_register(self, register, reset = False):
+    def _write_register(self, register, reset = False, force = False):
         if self._register_write_enabled:
-            super()._write_register(register, reset = reset)
-            self._bus.write(register.bytes)
+            super()._write_register(register, reset = reset, force = force)
+
+
+    def _write_bus_raw(self, bytes_array):
+        return self._bus.write(bytes_array)
+
+
+    def _bus_word_address(self, bytes_array):
+        return bytes_array[-1] & 0x7  # DB2:DB0 control bits.
+
+
+    def _register_words(self, register):
+        return (self.codecs[register.address].to_bytes(register.value),)
+
+
+    def _commit_registers(self, registers):
+        if self._bus_worker is not None or not hasattr(self._bus, 'queue') or self._bus.queueing:
+            return super()._commit_registers(registers)
+
+        self._bus.queue(True)
+        try:
+            super()._commit_registers(registers)
+        finally:
+            self._release_bus_queue()
+
+
+    def _release_bus_queue(self):
+        self._bus.queue(False)
+
+
+    def _flush_order(self, registers):
+        # Register 0 goes last, it latches the double buffered values.
+        return sorted(registers, key = lambda reg: reg.address, reverse = True)
 
 
     def _write_register_0(self):
-        self._write_register(self.map._registers[0])
+        self._write_register(self.map._registers[0], force = True)
 
 
     def _confirm_double_buffer(self):
         self._write_register_0()
 
 
-    def write_all_registers(self, reset = False):
+    def _write_changed_registers(self, reset = False):
         self._register_write_enabled = True
-        for reg in self.map._registers[::-1]:
-            self._write_register(reg, reset = reset)
+        force = self._force_writes
+        with self.transaction():
+            for reg in self.map._registers:
+                self._write_register(reg, reset = reset, force = force)
+            self._confirm_double_buffer()
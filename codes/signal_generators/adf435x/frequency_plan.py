@@ -0,0 +1,304 @@
+import json
+import math
+import struct
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+try:
+    from .adf4351 import ADF4351
+except:
+    from adf4351 import ADF4351
+
+_RF_N_Divider = ADF4351._RF_N_Divider
+_RF_Divider = ADF4351._RF_Divider
+_VCO = ADF4351._VCO
+_ReferenceInput = ADF4351._ReferenceInput
+_ReferenceDoubler = ADF4351._ReferenceDoubler
+_ReferenceDivider = ADF4351._ReferenceDivider
+_R_Counter = ADF4351._R_Counter
+
+
+
+def channel_modulus(freq_pfd, channel_resolution = None):
+    if channel_resolution is None:
+        return _RF_N_Divider.DENOMINATOR_MAX
+    return math.ceil(freq_pfd / channel_resolution)
+
+
+
+PLAN_DTYPE = np.dtype([('freq', '<f8'),
+                       ('valid', '?'),
+                       ('rf_divider', '<u2'),
+                       ('INT', '<u2'),
+                       ('FRAC', '<u2'),
+                       ('MOD', '<u2'),
+                       ('freq_vco', '<f8'),
+                       ('freq_achieved', '<f8'),
+                       ('error', '<f8')])
+
+
+
+def solve_frequencies(freqs, freq_pfd, mod, prescaler = '8/9', fundamental_feedback = True,
+                      band_select_enabled = True, rf_dividers = None):
+    # same constraints as ADF4351.set_frequency, tried from the largest RF divider down.
+    assert _RF_N_Divider.MOD_MIN <= mod <= _RF_N_Divider.MOD_MAX, \
+        'Must {} <= MOD ({}) <= {}'.format(_RF_N_Divider.MOD_MIN, mod, _RF_N_Divider.MOD_MAX)
+
+    freqs = np.asarray(freqs, dtype = np.float64)
+    plans = np.zeros(freqs.shape, dtype = PLAN_DTYPE)
+    plans['freq'] = freqs
+
+    if freq_pfd > _RF_N_Divider.FREQUENCY_PFD_MAX:
+        return plans
+    if freq_pfd > _RF_N_Divider.FREQUENCY_PFD_MAX_HALF and band_select_enabled:
+        return plans
+
+    int_min = _RF_N_Divider.INT_MIN[prescaler]
+    vco_max = _RF_N_Divider.FREQ_MAX_AT_PRESCALE_4_5 if prescaler == '4/5' else _VCO.FREQ_MAX
+    pending = np.ones(freqs.shape, dtype = bool)
+
+    for d in sorted(_RF_Divider.DIVIDERS, reverse = True) if rf_dividers is None else rf_dividers:
+        d_feedback = 1 if fundamental_feedback else d
+        n = freqs * d / d_feedback / freq_pfd
+
+        INT = np.floor(n)
+        FRAC = np.round(mod * (n - INT))
+        carry = FRAC == mod
+        INT = INT + carry
+        FRAC = np.where(carry, 0, FRAC)
+
+        freq_limit = np.where(FRAC == 0, _RF_N_Divider.FREQ_MAX_INTEGER_MODE, _RF_N_Divider.FREQ_MAX_FRACTIONAL_MODE)
+        freq_vco = freq_pfd * (INT + FRAC / mod) * d_feedback
+
+        ok = pending & (int_min <= n) & (n <= _RF_N_Divider.DIVIDER_MAX) & (INT <= _RF_N_Divider.INT_MAX)
+        ok &= (freq_pfd <= freq_limit) & (_VCO.FREQ_MIN <= freq_vco) & (freq_vco <= vco_max)
+
+        plans['valid'][ok] = True
+        plans['rf_divider'][ok] = d
+        plans['INT'][ok] = INT[ok]
+        plans['FRAC'][ok] = FRAC[ok]
+        plans['MOD'][ok] = mod
+        plans['freq_vco'][ok] = freq_vco[ok]
+        plans['freq_achieved'][ok] = freq_vco[ok] / d
+        pending &= ~ok
+
+    plans['error'] = np.where(plans['valid'], plans['freq_achieved'] - freqs, np.nan)
+    return plans
+
+
+
+def plan_frequencies(freqs, freq_pfd, channel_resolution = None, prescaler = '8/9', fundamental_feedback = True,
+                     band_select_enabled = True, rf_dividers = None):
+    return solve_frequencies(freqs, freq_pfd, channel_modulus(freq_pfd, channel_resolution),
+                             prescaler = prescaler,
+                             fundamental_feedback = fundamental_feedback,
+                             band_select_enabled = band_select_enabled,
+                             rf_dividers = rf_dividers)
+
+
+
+def solve_frequency(freq, freq_pfd, mod, prescaler = '8/9', fundamental_feedback = True,
+                    band_select_enabled = True, rf_dividers = None):
+    plan = solve_frequencies((freq,), freq_pfd, mod, prescaler = prescaler,
+                             fundamental_feedback = fundamental_feedback,
+                             band_select_enabled = band_select_enabled,
+                             rf_dividers = rf_dividers)[0]
+    if not plan['valid']:
+        return None
+
+    return (int(plan['rf_divider']), int(plan['INT']), int(plan['FRAC']), int(plan['MOD']), prescaler,
+            float(plan['freq_vco']), float(plan['freq_achieved']))
+
+
+
+INTEGER_N_DTYPE = np.dtype([('d_ref_doubler', 'u1'),
+                            ('d_r_counter', '<u2'),
+                            ('d_ref_divider', 'u1'),
+                            ('d_rf_n_divider', '<u2'),
+                            ('d_rf_divider', 'u1'),
+                            ('freq_pfd', '<f8'),
+                            ('freq_vco', '<f8'),
+                            ('freq_achieved', '<f8'),
+                            ('error', '<f8')])
+
+
+
+def find_integer_n_plans(freq, freq_ref, ref_doubled_by_2 = True, ref_divided_by_2 = True, rf_dividers = None,
+                         tolerance_hz = 1, prescaler = '8/9', fundamental_feedback = True,
+                         band_select_enabled = True, cycle_slip_reduction = True, low_spur_mode = False):
+    # ranked by error, then higher PFD (reference spurs further out), then smaller N (less in-band noise).
+    assert _ReferenceInput.FREQ_MIN <= freq_ref <= _ReferenceInput.FREQ_MAX, \
+        'freq_ref ranges between {:0.1e} ~ {:0.1e} Hz'.format(_ReferenceInput.FREQ_MIN, _ReferenceInput.FREQ_MAX)
+
+    pfd_max = _RF_N_Divider.FREQUENCY_PFD_MAX_HALF if band_select_enabled else _RF_N_Divider.FREQ_MAX_INTEGER_MODE
+    vco_max = _RF_N_Divider.FREQ_MAX_AT_PRESCALE_4_5 if prescaler == '4/5' else _VCO.FREQ_MAX
+    int_min = _RF_N_Divider.INT_MIN[prescaler]
+    r_counters = np.arange(1, 2 ** _R_Counter.DIVIDER_BITS, dtype = np.float64)
+    plans = []
+
+    for d_ref_doubler in (2,) if ref_doubled_by_2 else _ReferenceDoubler.DIVIDERS:
+        if d_ref_doubler == 2 and freq_ref > _ReferenceDoubler.FREQ_REF_MAX:
+            continue
+
+        for d_ref_divider in (2,) if ref_divided_by_2 else _ReferenceDivider.DIVIDERS:
+            if d_ref_divider == 1 and (cycle_slip_reduction or (d_ref_doubler == 2 and low_spur_mode)):
+                continue
+
+            for d_rf_divider in _RF_Divider.DIVIDERS if rf_dividers is None else rf_dividers:
+                freq_vco = freq * d_rf_divider
+                if not _VCO.FREQ_MIN <= freq_vco <= vco_max:
+                    continue
+
+                freq_pfd = freq_ref * d_ref_doubler / (r_counters * d_ref_divider)
+                d_feedback = 1 if fundamental_feedback else d_rf_divider
+                N = np.round(freq_vco / d_feedback / freq_pfd)
+                freq_vco_achieved = freq_pfd * N * d_feedback
+                freq_achieved = freq_vco_achieved / d_rf_divider
+
+                ok = (freq_pfd <= pfd_max) & (int_min <= N) & (N <= _RF_N_Divider.INT_MAX)
+                ok &= (_VCO.FREQ_MIN <= freq_vco_achieved) & (freq_vco_achieved <= vco_max)
+                ok &= np.abs(freq_achieved - freq) < tolerance_hz
+
+                found = np.zeros(np.count_nonzero(ok), dtype = INTEGER_N_DTYPE)
+                found['d_ref_doubler'] = d_ref_doubler
+                found['d_r_counter'] = r_counters[ok]
+                found['d_ref_divider'] = d_ref_divider
+                found['d_rf_n_divider'] = N[ok]
+                found['d_rf_divider'] = d_rf_divider
+                found['freq_pfd'] = freq_pfd[ok]
+                found['freq_vco'] = freq_vco_achieved[ok]
+                found['freq_achieved'] = freq_achieved[ok]
+                found['error'] = freq_achieved[ok] - freq
+                plans.append(found)
+
+    plans = np.concatenate(plans) if plans else np.zeros(0, dtype = INTEGER_N_DTYPE)
+    return plans[np.lexsort((plans['d_rf_n_divider'], -plans['freq_pfd'], np.abs(plans['error'])))]
+
+
+
+def find_integer_n_plans_many(freqs, freq_ref, processes = None, **kwargs):
+    search = partial(find_integer_n_plans, freq_ref = freq_ref, **kwargs)
+
+    if processes is None:
+        return [search(freq) for freq in freqs]
+
+    with Pool(processes) as pool:
+        return pool.map(search, freqs)
+
+
+
+class FrequencyPlan:
+    MAGIC = b'ADF4351P'
+    HEADER_ALIGNMENT = 16
+    DTYPE = np.dtype([('freq', '<f8'),
+                      ('INT', '<u2'),
+                      ('FRAC', '<u2'),
+                      ('MOD', '<u2'),
+                      ('RF_Divider_Select', 'u1'),
+                      ('Prescaler_Value', 'u1')])
+
+
+    def __init__(self, table, freq_pfd, channel_resolution = None, prescaler = '8/9',
+                 fundamental_feedback = True, band_select_enabled = True):
+        self.table = table
+        self.freq_pfd = freq_pfd
+        self.channel_resolution = channel_resolution
+        self.prescaler = prescaler
+        self.fundamental_feedback = fundamental_feedback
+        self.band_select_enabled = band_select_enabled
+
+
+    def __len__(self):
+        return len(self.table)
+
+
+    @property
+    def config(self):
+        return {'freq_pfd'            : self.freq_pfd,
+                'channel_resolution'  : self.channel_resolution,
+                'prescaler'           : self.prescaler,
+                'fundamental_feedback': self.fundamental_feedback,
+                'band_select_enabled' : self.band_select_enabled}
+
+
+    @classmethod
+    def config_of(cls, adf):
+        return {'freq_pfd'            : adf.freq_pfd,
+                'channel_resolution'  : adf.rf_out.channel_resolution,
+                'prescaler'           : adf.rf_n_divider.prescaler,
+                'fundamental_feedback': adf.rf_n_divider.fundamental_as_feedback,
+                'band_select_enabled' : adf.band_select_clock_divider.band_select_enabled}
+
+
+    @classmethod
+    def compile(cls, freqs, freq_pfd, channel_resolution = None, prescaler = '8/9',
+                fundamental_feedback = True, band_select_enabled = True):
+        freqs = np.unique(np.asarray(freqs, dtype = np.float64))
+        plans = plan_frequencies(freqs, freq_pfd, channel_resolution = channel_resolution, prescaler = prescaler,
+                                 fundamental_feedback = fundamental_feedback,
+                                 band_select_enabled = band_select_enabled)
+        if not plans['valid'].all():
+            raise ValueError('Failed in planning frequencies {}.'.format(freqs[~plans['valid']]))
+
+        table = np.zeros(len(freqs), dtype = cls.DTYPE)
+        table['freq'] = freqs
+        table['INT'] = plans['INT']
+        table['FRAC'] = plans['FRAC']
+        table['MOD'] = plans['MOD']
+        table['RF_Divider_Select'] = np.log2(plans['rf_divider']).astype(np.uint8)
+        table['Prescaler_Value'] = _RF_N_Divider.PRESCALERS[prescaler]
+
+        return cls(table, freq_pfd, channel_resolution = channel_resolution, prescaler = prescaler,
+                   fundamental_feedback = fundamental_feedback, band_select_enabled = band_select_enabled)
+
+
+    @classmethod
+    def compile_for(cls, adf, freqs):
+        return cls.compile(freqs, **cls.config_of(adf))
+
+
+    def save(self, path):
+        header = json.dumps(dict(self.config, n_rows = len(self.table))).encode()
+        len_header = len(self.MAGIC) + 4 + len(header)
+        header += b' ' * (-len_header % self.HEADER_ALIGNMENT)
+
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            f.write(np.ascontiguousarray(self.table, dtype = self.DTYPE).tobytes())
+
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            assert f.read(len(cls.MAGIC)) == cls.MAGIC, '{} is not a frequency plan file.'.format(path)
+            len_header, = struct.unpack('<I', f.read(4))
+            config = json.loads(f.read(len_header).decode())
+
+        n_rows = config.pop('n_rows')
+        offset = len(cls.MAGIC) + 4 + len_header
+        table = np.memmap(path, dtype = cls.DTYPE, mode = 'r', offset = offset, shape = (n_rows,)) if n_rows \
+            else np.zeros(0, dtype = cls.DTYPE)
+
+        return cls(table, **config)
+
+
+    def index_of(self, freq, tolerance_hz = 1):
+        freqs = self.table['freq']
+        i = int(np.searchsorted(freqs, freq))
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(freqs)]
+        assert candidates, 'Frequency plan is empty.'
+
+        j = min(candidates, key = lambda k: abs(freqs[k] - freq))
+        assert abs(freqs[j] - freq) <= tolerance_hz, 'Frequency {} is not in the plan.'.format(freq)
+        return j
+
+
+    def lookup(self, freq, tolerance_hz = 1):
+        row = self.table[self.index_of(freq, tolerance_hz = tolerance_hz)]
+        return (_RF_Divider.DIVIDERS[int(row['RF_Divider_Select'])],
+                int(row['INT']), int(row['FRAC']), int(row['MOD']),
+                _RF_N_Divider.PRESCALERS_value_key[int(row['Prescaler_Value'])])
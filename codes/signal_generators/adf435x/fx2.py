@@ -1,5 +1,7 @@
 # https://ez.analog.com/rf/f/discussions/75850/adf4350-and-adf4351-software-and-usb-microcontroller-firmware-source-codes#52311
 
+from array import array
+
 import usb
 import usb.backend.libusb0 as libusb0
 import usb.backend.libusb1 as libusb1
@@ -9,6 +11,9 @@ from utilities.adapters.peripherals import Bus
 
 
 class AnalogDevicesFX2LP(Bus):
+    WORD_BYTES = 4
+    WORDS_PER_TRANSFER = 1  # firmware 1.0 VR_SPI shifts out one word (max 32 bits) per control transfer.
+
 
     def __init__(self, use_libusb0 = True):
 
@@ -18,6 +23,9 @@ class AnalogDevicesFX2LP(Bus):
         if self.dev is not None:
             self.dev.set_configuration()
 
+        self._queueing = False
+        self._queue = []
+
         super().__init__(self.dev)
 
 
@@ -25,8 +33,52 @@ class AnalogDevicesFX2LP(Bus):
         pass
 
 
+    @property
+    def queueing(self):
+        return self._queueing
+
+
+    def queue(self, value = True):
+        self._queueing = value
+        if not value:
+            self.flush()
+
+
+    def flush(self):
+        bytes_arrays, self._queue = self._queue, []
+        self.write_many(bytes_arrays)
+
+
     def write(self, bytes_array):
+        if self._queueing:
+            self._queue.append(bytes_array)
+        else:
+            self.write_many((bytes_array,))
+
+
+    def write_many(self, bytes_arrays):
         if not self.is_virtual_device:
-            bytes_array.insert(0, 8 * len(bytes_array))
-            return self.dev.ctrl_transfer(bmRequestType = 0x40, bRequest = 0xDD, wValue = 0, wIndex = 0,
-                                          data_or_wLength = bytes_array[::-1])
+            for payload in self._pack(bytes_arrays):
+                self.dev.ctrl_transfer(bmRequestType = 0x40, bRequest = 0xDD, wValue = 0, wIndex = 0,
+                                       data_or_wLength = payload)
+
+
+    def _pack(self, bytes_arrays):
+        # each word: WORD_BYTES bytes LSB first, then the number of bits to shift out.
+        payloads = []
+        payload = array('B')
+
+        for bytes_array in bytes_arrays:
+            word = array('B', bytes_array[::-1])
+            payload.extend(word)
+            payload.extend(array('B', [0] * (self.WORD_BYTES - len(word))))
+            payload.append(8 * len(word))
+
+            if len(payload) == (self.WORD_BYTES + 1) * self.WORDS_PER_TRANSFER:
+                payloads.append(payload)
+                payload = array('B')
+
+        if payload:
+            payloads.append(payload)
+
+        return payloads
@@ -1,8 +1,13 @@
 try:
+    from ..register_codec import RegisterCodec
     from utilities.register import *
 except:
+    from register_codec import RegisterCodec
     from register import *
 
+_registers_table = None
+_elements_descriptions = None
+
 
 
 def _get_all_registers():
@@ -199,3 +204,51 @@ def _get_registers_map():
         ele.read_only = True
 
     return regs_map
+
+
+
+def _get_registers_table():
+    # (name, address, description, default_value, ((name, idx_lowest_bit, n_bits, value, read_only), ...)), built once.
+    global _registers_table
+    if _registers_table is None:
+        _registers_table = tuple((reg.name, reg.address, reg.description, reg.default_value,
+                                  tuple((e.name, e.idx_lowest_bit, e.n_bits, e.value, e.read_only)
+                                        for e in reg._elements))
+                                 for reg in _get_registers_map()._registers)
+    return _registers_table
+
+
+
+def _clone_registers_map():
+    registers = [Register(name = name, address = address, description = description,
+                          elements = [Element(name = e_name, idx_lowest_bit = idx_lowest_bit, n_bits = n_bits,
+                                              value = value, read_only = read_only, description = '')
+                                      for (e_name, idx_lowest_bit, n_bits, value, read_only) in elements],
+                          default_value = default_value)
+                 for (name, address, description, default_value, elements) in _get_registers_table()]
+
+    return RegistersMap(name = 'ADF4351', description = 'ADF4351 registers.', registers = registers)
+
+
+
+def _get_elements_descriptions():
+    global _elements_descriptions
+    if _elements_descriptions is None:
+        _elements_descriptions = {(reg.name, e.name): e.description
+                                  for reg in _get_all_registers() for e in reg._elements}
+    return _elements_descriptions
+
+
+
+def _load_descriptions(regs_map):
+    descriptions = _get_elements_descriptions()
+    for reg in regs_map._registers:
+        for e in reg._elements:
+            if not e.description:
+                e.description = descriptions.get((reg.name, e.name), '')
+    return regs_map
+
+
+
+def _get_registers_codecs(regs_map):
+    return {reg.address: RegisterCodec.of(reg) for reg in regs_map._registers}
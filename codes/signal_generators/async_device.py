@@ -0,0 +1,138 @@
+import asyncio
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .buses import bus_handle
+except:
+    from buses import bus_handle
+
+
+
+class AsyncDevice:
+    # every operation of a device runs on the single worker thread owning its bus, so writes never interleave.
+    _executors = weakref.WeakKeyDictionary()  # bus handle: executor, dropped with the bus.
+    _pinned_executors = {}  # for bus handles that cannot be weakly referenced, e.g. None without hardware.
+
+
+    def __init__(self, device, executor = None):
+        self._device = device
+        self._executor = self.executor_for(device._bus) if executor is None else executor
+
+
+    @classmethod
+    def executor_for(cls, bus):
+        handle = bus_handle(bus)
+        try:
+            executors = cls._executors
+            executor = executors.get(handle)
+        except TypeError:
+            executors = cls._pinned_executors
+            executor = executors.get(handle)
+
+        if executor is None:
+            executor = executors[handle] = ThreadPoolExecutor(max_workers = 1)
+        return executor
+
+
+    @classmethod
+    def shutdown(cls, wait = True):
+        executors = list(cls._executors.values()) + list(cls._pinned_executors.values())
+        cls._executors = weakref.WeakKeyDictionary()
+        cls._pinned_executors = {}
+        for executor in executors:
+            executor.shutdown(wait = wait)
+
+
+    @property
+    def device(self):
+        return self._device
+
+
+    async def call(self, fun, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+                                          functools.partial(getattr(self._device, fun), *args, **kwargs))
+
+
+    async def init(self):
+        return await self.call('init')
+
+
+    async def reset(self):
+        return await self.call('reset')
+
+
+    async def update(self):
+        return await self.call('update')
+
+
+    async def enable(self, value = True):
+        return await self.call('enable', value)
+
+
+    async def enable_output(self, value = True):
+        return await self.call('enable_output', value)
+
+
+    async def apply_signal(self, *args, **kwargs):
+        return await self.call('apply_signal', *args, **kwargs)
+
+
+    async def set_frequency(self, *args, **kwargs):
+        return await self.call('set_frequency', *args, **kwargs)
+
+
+    async def set_phase(self, *args, **kwargs):
+        return await self.call('set_phase', *args, **kwargs)
+
+
+    async def select_freq_source(self, idx):
+        return await self.call('select_freq_source', idx)
+
+
+    async def select_phase_source(self, idx):
+        return await self.call('select_phase_source', idx)
+
+
+    async def set_shape(self, shape):
+        return await self.call('__setattr__', 'shape', shape)
+
+
+
+def async_device(device):
+    # kept on the device, so it lives exactly as long as the device.
+    wrapper = device.__dict__.get('_async_device')
+    if wrapper is None:
+        wrapper = device._async_device = AsyncDevice(device)
+    return wrapper
+
+
+
+async def do_on_devices(devices, fun, *args, **kwargs):
+    return await asyncio.gather(*(async_device(d).call(fun, *args, **kwargs) for d in devices))
+
+
+
+async def process_symbol(channels, symbol):
+    # a modulators.MultipleChannels symbol, with the channel updates running concurrently on their buses.
+    assert symbol in channels.SYMBOLS, 'Symbol must be in {}'.format(channels.SYMBOLS)
+    channels._symbol = symbol
+    return await asyncio.gather(*(async_device(device).call(fun, **kwargs)
+                                  for (device, fun, kwargs) in channels._channel_updates(symbol)))
+
+
+
+async def send_sequence(channels, sequence):
+    loop = asyncio.get_running_loop()
+    channels.reset()
+    channels.enable_output(True)
+
+    deadline = loop.time()
+    for (symbol, duration) in sequence:
+        await process_symbol(channels, symbol)
+        deadline += duration
+        await asyncio.sleep(max(deadline - loop.time(), 0))
+
+    channels.enable_output(False)
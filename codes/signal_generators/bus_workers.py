@@ -0,0 +1,108 @@
+import threading
+from collections import deque
+
+try:
+    from .buses import bus_key
+except:
+    from buses import bus_key
+
+
+
+class BusWorker(threading.Thread):
+    # owns one physical bus; queued writes run on this thread in the order they were submitted.
+
+    def __init__(self, name = None):
+        super().__init__(name = name, daemon = True)
+        self._queue = deque()  # append / popleft are atomic, producers never take a lock.
+        self._wakeup = threading.Event()
+        self._running = True
+        self._error = None
+        self.n_written = 0
+
+
+    def submit(self, write, bytes_array):
+        self._raise_pending_error()
+        self._queue.append((write, bytes_array))
+        self._wakeup.set()
+
+
+    def run(self):
+        while self._running:
+            self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._queue:
+                write, bytes_array = self._queue.popleft()
+                if write is None:  # drain marker.
+                    bytes_array.set()
+                    continue
+                try:
+                    write(bytes_array)
+                except Exception as e:
+                    self._error = e
+                self.n_written += 1
+
+
+    def drain(self, timeout = None):
+        # waits until everything submitted before this call has been written.
+        marker = threading.Event()
+        self._queue.append((None, marker))
+        self._wakeup.set()
+        done = marker.wait(timeout)
+        self._raise_pending_error()
+        return done
+
+
+    def stop(self, timeout = None):
+        self.drain(timeout)
+        self._running = False
+        self._wakeup.set()
+        self.join(timeout)
+
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+
+    def _raise_pending_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+
+class BusMultiplexer:
+    # one worker per physical bus, shared by every device whose bus wraps the same handle.
+
+    def __init__(self):
+        self._workers = {}
+
+
+    def worker_for(self, bus):
+        key = bus_key(bus)
+        if key not in self._workers:
+            worker = BusWorker(name = 'bus-{}'.format(len(self._workers)))
+            worker.start()
+            self._workers[key] = (bus, worker)  # keeps bus alive, so the id is not reused.
+        return self._workers[key][1]
+
+
+    def attach(self, *devices):
+        for device in devices:
+            device.attach_bus_worker(self.worker_for(device._bus))
+
+
+    def detach(self, *devices):
+        for device in devices:
+            device.attach_bus_worker(None)
+
+
+    def drain(self, timeout = None):
+        return all([worker.drain(timeout) for (_, worker) in self._workers.values()])
+
+
+    def stop(self, timeout = None):
+        workers, self._workers = self._workers, {}
+        for (_, worker) in workers.values():
+            worker.stop(timeout)
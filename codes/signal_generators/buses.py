@@ -0,0 +1,236 @@
+import time
+
+try:
+    from .ad98xx.ad98xx import ControlRegister, POW2_12, POW2_28, POW2_32, POW2_5, DEGREES_IN_PI2
+    from .adf435x.registers_map import _clone_registers_map, _get_registers_codecs
+    from .register_codec import RegisterCodec
+except:
+    from ad98xx import ControlRegister, POW2_12, POW2_28, POW2_32, POW2_5, DEGREES_IN_PI2
+    from registers_map import _clone_registers_map, _get_registers_codecs
+    from register_codec import RegisterCodec
+
+SPI_CLOCK_HZ = int(1e6)
+FX2_TRANSFER_LATENCY_S = 0.5e-3  # host round trip of one vendor control transfer.
+
+
+
+def bus_handle(bus):
+    # devices sharing a physical bus (e.g. one SPI with several chip selects) share the underlying handle.
+    handle = getattr(bus, '_bus', None)
+    return bus if handle is None else handle
+
+
+
+def bus_key(bus):
+    return id(bus_handle(bus))
+
+
+
+class CountingBus:
+    # an in-memory bus for running drivers without hardware; counts what would have been written.
+
+    def __init__(self, keep_writes = False):
+        self.keep_writes = keep_writes
+        self.reset_counters()
+
+
+    @property
+    def is_virtual_device(self):
+        return True
+
+
+    def init(self):
+        pass
+
+
+    def reset_counters(self):
+        self.n_transfers = 0
+        self.n_bytes = 0
+        self.writes = []
+
+
+    def write(self, bytes_array):
+        self.n_transfers += 1
+        self.n_bytes += len(bytes_array)
+        if self.keep_writes:
+            self.writes.append(bytes(bytes_array))
+
+
+
+class SimulatedBus(CountingBus):
+    # decodes writes into chip state and accounts the time the transfers would take on a real bus.
+
+    def __init__(self, decoder = None, clock_hz = None, transfer_latency_s = 0, realtime = False,
+                 keep_writes = False):
+        self.decoder = decoder
+        self.clock_hz = clock_hz
+        self.transfer_latency_s = transfer_latency_s
+        self.realtime = realtime
+        super().__init__(keep_writes = keep_writes)
+
+
+    @classmethod
+    def spi(cls, decoder = None, clock_hz = SPI_CLOCK_HZ, **kwargs):
+        return cls(decoder = decoder, clock_hz = clock_hz, **kwargs)
+
+
+    @classmethod
+    def fx2(cls, decoder = None, transfer_latency_s = FX2_TRANSFER_LATENCY_S, **kwargs):
+        return cls(decoder = decoder, transfer_latency_s = transfer_latency_s, **kwargs)
+
+
+    def reset_counters(self):
+        super().reset_counters()
+        self.busy_s = 0
+
+
+    def transfer_time_s(self, n_bytes):
+        return self.transfer_latency_s + (8 * n_bytes / self.clock_hz if self.clock_hz else 0)
+
+
+    def write(self, bytes_array):
+        super().write(bytes_array)
+
+        t = self.transfer_time_s(len(bytes_array))
+        self.busy_s += t
+        if self.realtime:
+            time.sleep(t)
+
+        if self.decoder is not None:
+            self.decoder.decode(bytes_array)
+
+
+    @property
+    def transfers_per_s(self):
+        return self.n_transfers / self.busy_s if self.busy_s else None
+
+
+    @property
+    def bytes_per_s(self):
+        return self.n_bytes / self.busy_s if self.busy_s else None
+
+
+
+class AD98xxDecoder:
+    # AD9833 / AD9834: 16-bit words, D15:D14 select control (00), FREQ0 (01), FREQ1 (10) or PHASE (11).
+
+    def __init__(self, freq_mclk = int(25e6)):
+        self.freq_mclk = freq_mclk
+        self.codec = RegisterCodec.of(ControlRegister())
+        self.control = 0
+        self.frequency_words = [0, 0]
+        self.phase_words = [0, 0]
+        self._lsb_pending = [None, None]
+
+
+    def decode(self, bytes_array):
+        word = (bytes_array[0] << 8) | bytes_array[1]
+        target = word >> 14
+        data = word & 0x3FFF
+
+        if target == 0:
+            self.control = word
+        elif target == 3:
+            self.phase_words[(word >> 13) & 0x1] = word & 0xFFF
+        else:
+            self._decode_frequency(target - 1, data)
+
+
+    def _decode_frequency(self, idx, data):
+        if self.control_bit('B28'):  # LSBs then MSBs, latched together.
+            if self._lsb_pending[idx] is None:
+                self._lsb_pending[idx] = data
+            else:
+                self.frequency_words[idx] = (data << 14) | self._lsb_pending[idx]
+                self._lsb_pending[idx] = None
+        elif self.control_bit('HLB'):
+            self.frequency_words[idx] = (data << 14) | (self.frequency_words[idx] & 0x3FFF)
+        else:
+            self.frequency_words[idx] = (self.frequency_words[idx] & 0xFFFC000) | data
+
+
+    def control_bit(self, name):
+        return self.codec.get(self.control, name)
+
+
+    def frequency(self, idx = None):
+        idx = self.control_bit('FSELECT') if idx is None else idx
+        return self.frequency_words[idx] * self.freq_mclk / POW2_28
+
+
+    def phase(self, idx = None):
+        idx = self.control_bit('PSELECT') if idx is None else idx
+        return self.phase_words[idx] * DEGREES_IN_PI2 / POW2_12
+
+
+    @property
+    def output_enabled(self):
+        return not self.control_bit('Reset')
+
+
+
+class AD9850Decoder:
+    # 40-bit words sent LSB first: W0..W3 frequency, then power down and 5 phase bits.
+
+    def __init__(self, freq_mclk = int(125e6)):
+        self.freq_mclk = freq_mclk
+        self.word = 0
+
+
+    def decode(self, bytes_array):
+        self.word = int.from_bytes(bytes(bytes_array), 'little')
+
+
+    def frequency(self):
+        return (self.word & 0xFFFFFFFF) * self.freq_mclk / POW2_32
+
+
+    def phase(self):
+        return (self.word >> 35) * DEGREES_IN_PI2 / POW2_5
+
+
+    @property
+    def output_enabled(self):
+        return not (self.word >> 34) & 0x1
+
+
+
+class ADF4351Decoder:
+    # 32-bit words, the 3 LSBs address the register.
+
+    def __init__(self, freq_ref = int(25e6)):
+        self.freq_ref = freq_ref
+        self.codecs = _get_registers_codecs(_clone_registers_map())
+        self.registers = {address: 0 for address in self.codecs}
+        self.n_latches = 0  # writes to register 0, which latch the double buffered values.
+
+
+    def decode(self, bytes_array):
+        word = int.from_bytes(bytes(bytes_array), 'big')
+        address = word & 0x7
+        self.registers[address] = word
+        if address == 0:
+            self.n_latches += 1
+
+
+    def field(self, address, name):
+        return self.codecs[address].get(self.registers[address], name)
+
+
+    @property
+    def freq_pfd(self):
+        return self.freq_ref * (1 + self.field(2, 'Reference_Doubler')) / \
+               (max(self.field(2, 'R_Counter'), 1) * (1 + self.field(2, 'RDIV2')))
+
+
+    def frequency(self):
+        n = self.field(0, 'INT') + self.field(0, 'FRAC') / max(self.field(1, 'MOD'), 1)
+        rf_divider = 2 ** self.field(4, 'RF_Divider_Select')
+        freq_feedback = n * self.freq_pfd
+        freq_vco = freq_feedback if self.field(4, 'Feedback_Select') else freq_feedback * rf_divider
+        return freq_vco / rf_divider
+
+
+    @property
+    def output_enabled(self):
+        return bool(self.field(4, 'RF_Output_Enable')) and not self.field(2, 'Power_Down')
@@ -0,0 +1,195 @@
+try:
+    from .scheduler import ticks_ns
+except:
+    from scheduler import ticks_ns
+
+
+
+class LatencyHistogram:
+    # log-linear buckets as in HdrHistogram: values keep SUB_BUCKET_BITS significant bits (within 1/64 = 1.6%).
+    SUB_BUCKET_BITS = 7
+    PERCENTILES = (50, 90, 99, 99.9)
+
+
+    def __init__(self, sub_bucket_bits = SUB_BUCKET_BITS):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.reset()
+
+
+    def reset(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+
+    def _key(self, value):
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        return (shift << self.sub_bucket_bits) + (value >> shift)
+
+
+    def _value_of(self, key):
+        # highest value equivalent to the bucket.
+        shift = key >> self.sub_bucket_bits
+        if shift == 0:
+            return key
+        sub_bucket = key & ((1 << self.sub_bucket_bits) - 1)
+        return (sub_bucket << shift) + (1 << shift) - 1
+
+
+    def record(self, value):
+        value = max(int(value), 0)
+        key = self._key(value)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        rank = max(1, int(p / 100 * self.count + 0.5))
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                return min(self._value_of(key), self.max)
+        return self.max
+
+
+    def summary(self):
+        summary = {'count': self.count, 'min': self.min, 'mean': self.mean, 'max': self.max}
+        for p in self.PERCENTILES:
+            summary['p{}'.format(p)] = self.percentile(p)
+        return summary
+
+
+
+class OperationStats:
+
+    def __init__(self):
+        self.wall_ns = LatencyHistogram()
+        self.bus_ns = LatencyHistogram()
+        self.bus_writes = 0
+
+
+    @property
+    def calls(self):
+        return self.wall_ns.count
+
+
+    def record(self, wall_ns, bus_ns, bus_writes):
+        self.wall_ns.record(wall_ns)
+        self.bus_ns.record(bus_ns)
+        self.bus_writes += bus_writes
+
+
+    def summary(self):
+        return {'calls'     : self.calls,
+                'bus_writes': self.bus_writes,
+                'wall_ns'   : self.wall_ns.summary(),
+                'bus_ns'    : self.bus_ns.summary()}
+
+
+
+class Instrumentation:
+
+    def __init__(self, device):
+        self._device = device
+        self.operations = {}
+        self.bus_io = {}  # method name: LatencyHistogram of each call, also for writes outside INSTRUMENTED_OPS.
+        self.bus_ns = 0
+        self._wrapped = []
+        self._bus_hook = None
+
+
+    def attach(self):
+        device = self._device
+        self._bus_hook = device.add_bus_hook(self._timed_bus_write)
+        for name in device.BUS_IO_METHODS:
+            self._wrap(name, self._timed_bus_io(name, getattr(device, name)))
+        for name in device.INSTRUMENTED_OPS:
+            self._wrap(name, self._timed_operation(name, getattr(device, name)))
+
+
+    def detach(self):
+        if self._bus_hook is not None:
+            self._device.remove_bus_hook(self._bus_hook)
+            self._bus_hook = None
+        for (name, previous) in reversed(self._wrapped):
+            if previous is None:
+                delattr(self._device, name)
+            else:
+                setattr(self._device, name, previous)
+        self._wrapped = []
+
+
+    def reset(self):
+        self.operations = {}
+        self.bus_io = {}
+
+
+    def _wrap(self, name, wrapper):
+        # shadows the class method with an instance attribute, remembering any instance attribute it replaces.
+        self._wrapped.append((name, self._device.__dict__.get(name)))
+        setattr(self._device, name, wrapper)
+
+
+    def _record_bus_io(self, name, ns):
+        self.bus_ns += ns
+        histogram = self.bus_io.get(name)
+        if histogram is None:
+            histogram = self.bus_io[name] = LatencyHistogram()
+        histogram.record(ns)
+
+
+    def _timed_bus_write(self, bytes_array, ns):
+        self._record_bus_io('_write_bus', ns)
+
+
+    def _timed_bus_io(self, name, fun):
+
+        def bus_io(*args, **kwargs):
+            t0 = ticks_ns()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                self._record_bus_io(name, ticks_ns() - t0)
+
+        return bus_io
+
+
+    def _timed_operation(self, name, fun):
+        device = self._device
+
+        def operation(*args, **kwargs):
+            n_writes = device._n_bus_writes
+            bus_ns = self.bus_ns
+            t0 = ticks_ns()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                wall_ns = ticks_ns() - t0
+                stats = self.operations.get(name)
+                if stats is None:
+                    stats = self.operations[name] = OperationStats()
+                stats.record(wall_ns, self.bus_ns - bus_ns, device._n_bus_writes - n_writes)
+
+        return operation
+
+
+    def stats(self):
+        stats = {name: stats.summary() for (name, stats) in self.operations.items()}
+        if self.bus_io:
+            stats['bus_io'] = {name: histogram.summary() for (name, histogram) in self.bus_io.items()}
+        return stats
@@ -1,5 +1,14 @@
 import math
 
+try:
+    from .instrumentation import Instrumentation
+    from .scheduler import ticks_ns
+    from .tracing import ActionTrace, format_action
+except:
+    from instrumentation import Instrumentation
+    from scheduler import ticks_ns
+    from tracing import ActionTrace, format_action
+
 
 SPEED_OF_LIGHT_M_S = 299792458
 PI2 = 2 * math.pi
@@ -12,16 +21,78 @@ SHAPE_DEFAULT = 'sine'
 
 
 
+class Transaction:
+
+    def __init__(self, device):
+        self._device = device
+
+
+    def __enter__(self):
+        self._device._transaction_depth += 1
+        return self._device
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._device._transaction_depth -= 1
+        if self._device._transaction_depth == 0:
+            self._device.flush()
+
+
+
+class BusCapture:
+
+    def __init__(self, device):
+        self._device = device
+        self.words = []
+
+
+    def __enter__(self):
+        self._previous = self._device.__dict__.get('_write_bus')
+        self._bus_worker, self._device._bus_worker = self._device._bus_worker, None
+        self._device._write_bus = self.words.append  # shadows the class method until exit.
+        return self.words
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._previous is None:
+            del self._device._write_bus
+        else:
+            self._device._write_bus = self._previous
+        self._device._bus_worker = self._bus_worker
+
+
+
 class DeviceBase:
     DEBUG_MODE = False
     DEBUG_MODE_SHOW_BUS_DATA = DEBUG_MODE
     DEBUG_MODE_PRINT_REGISTER = DEBUG_MODE
+    SHADOW_CACHE_ENABLED = True
+    TRACE_ACTIONS = DEBUG_MODE
+    TRACE_SIZE = ActionTrace.SIZE
+    INSTRUMENTED_OPS = ('set_frequency', 'set_phase', 'enable_output', 'apply_signal', 'write_all_registers')
+    BUS_IO_METHODS = ()  # timed by wrapping them; _write_bus is timed by a bus hook.
 
 
     def __init__(self, registers_map = None, registers_values = None, commands = None):
 
         self._enabled = False
-        self._action = ''
+        self._action = None
+        self._action_trace = ActionTrace(self.TRACE_SIZE)
+        self._tracing = self.TRACE_ACTIONS or self.DEBUG_MODE_SHOW_BUS_DATA
+        self._bus_trace = None
+        self._bus_trace_id = 0
+        self._bus_trace_hook = None
+        self._bus_hooks = ()  # replaced, never mutated, so a bus worker thread can iterate it safely.
+        self._n_bus_writes = 0
+        self._instrumentation = None
+        self._bus_worker = None
+
+        self._transaction_depth = 0
+        self._dirty_registers = {}
+        self._registers_written = {}
+        self._n_writes_suppressed = 0
+        self._n_stateful_writes = 0  # writes whose words depend on earlier writes, e.g. on a bus mode.
+        self._shadow_cache_enabled = self.SHADOW_CACHE_ENABLED
 
         self.map = registers_map
         if registers_values is not None:
@@ -70,7 +141,7 @@ class DeviceBase:
 
 
     def load_registers(self, addressed_values):
-        self._action = 'load_registers_values'
+        self._trace('load_registers_values')
         self.map.load_values(addressed_values)
 
 
@@ -85,7 +156,7 @@ class DeviceBase:
 
 
     def enable(self, value = True):
-        self._action = 'enable {}'.format(value)
+        self._trace('enable', value)
         self._enabled = value
         self.enable_output(value)
 
@@ -95,58 +166,229 @@ class DeviceBase:
 
 
     def enable_output(self, value = True):
-        self._action = 'enable_output: {}'.format(value)
+        self._trace('enable_output', value)
         raise NotImplementedError()
 
 
     def init(self):
-        self._action = 'init'
+        self._trace('init')
         raise NotImplementedError()
 
 
     def start(self):
-        self._action = 'start'
+        self._trace('start')
         self.enable(True)
 
 
     def pause(self):
-        self._action = 'pause'
+        self._trace('pause')
         self.enable(False)
 
 
     def resume(self):
-        self._action = 'resume'
+        self._trace('resume')
         self.enable(True)
 
 
     def stop(self):
-        self._action = 'stop'
+        self._trace('stop')
         self.pause()
 
 
     def close(self):
-        self._action = 'close'
+        self._trace('close')
         self.stop()
 
 
     def update(self):
-        self._action = 'update'
+        self._trace('update')
+        self.invalidate_shadow_cache()
         self.write_all_registers(reset = False)
 
 
     def reset(self):
-        self._action = 'reset'
+        self._trace('reset')
+        self.invalidate_shadow_cache()
         self.write_all_registers(reset = True)
 
 
     def print(self, as_hex = False):
-        self._action = 'print'
+        self._trace('print')
         self.map.print(as_hex)
 
 
+    @property
+    def tracing(self):
+        return self._tracing
+
+
+    def enable_tracing(self, value = True):
+        self._tracing = value
+
+
+    def _trace(self, op, *args):
+        if self._tracing:
+            self._action = (op, args)
+            self._action_trace.record(self._action)
+
+
+    @property
+    def action(self):
+        return format_action(self._action)
+
+
+    @property
+    def action_trace(self):
+        return self._action_trace.events
+
+
+    def dump_trace(self):
+        self._action_trace.dump()
+
+
+    @property
+    def bus_trace(self):
+        return self._bus_trace
+
+
+    def attach_bus_trace(self, bus_trace):
+        # a bus hook, so only words reaching the bus are traced: captures are not, plan playback is.
+        if self._bus_trace_hook is not None:
+            self.remove_bus_hook(self._bus_trace_hook)
+            self._bus_trace_hook = None
+
+        self._bus_trace = bus_trace
+        self._bus_trace_id = None if bus_trace is None else bus_trace.register(self)
+
+        if bus_trace is not None:
+            self._bus_trace_hook = self.add_bus_hook(self._bus_trace_recorder(bus_trace, self._bus_trace_id))
+        return self._bus_trace_id
+
+
+    def _bus_trace_recorder(self, bus_trace, device_id):
+        address_of = self._bus_word_address
+
+        def record(bytes_array, ns):
+            bus_trace.record(device_id, address_of(bytes_array), bytes_array)
+
+        return record
+
+
+    def _bus_word_address(self, bytes_array):
+        # the register a bus word is written to, read from the word itself: writes may come pre-encoded.
+        return None
+
+
+    def add_bus_hook(self, hook):
+        # hook(bytes_array, ns) is called after each word _write_bus puts on the bus, with the time the write took.
+        self._bus_hooks = self._bus_hooks + (hook,)
+        return hook
+
+
+    def remove_bus_hook(self, hook):
+        self._bus_hooks = tuple(h for h in self._bus_hooks if h is not hook)
+
+
+    @property
+    def bus_worker(self):
+        return self._bus_worker
+
+
+    def attach_bus_worker(self, bus_worker):
+        # with a worker, words are encoded here and written later on the worker's thread.
+        self._bus_worker = bus_worker
+
+
+    def _bus_writer(self):
+        # for paths writing pre-encoded words: queued behind the bus worker's earlier writes when one is attached.
+        worker = self._bus_worker
+        if worker is None:
+            return self._write_bus
+
+        write = self._write_bus
+
+        def submit(bytes_array):
+            worker.submit(write, bytes_array)
+
+        return submit
+
+
+    def _drain_bus_worker(self):
+        if self._bus_worker is not None:
+            self._bus_worker.drain()
+
+
+    @property
+    def instrumented(self):
+        return self._instrumentation is not None
+
+
+    def enable_instrumentation(self, value = True):
+        if value and self._instrumentation is None:
+            self._instrumentation = Instrumentation(self)
+            self._instrumentation.attach()
+        elif not value and self._instrumentation is not None:
+            self._instrumentation.detach()
+            self._instrumentation = None
+
+
+    def stats(self):
+        return {} if self._instrumentation is None else self._instrumentation.stats()
+
+
+    def reset_stats(self):
+        if self._instrumentation is not None:
+            self._instrumentation.reset()
+
+
+    def transaction(self):
+        return Transaction(self)
+
+
+    def capture_bus(self):
+        return BusCapture(self)
+
+
+    @property
+    def in_transaction(self):
+        return self._transaction_depth > 0
+
+
+    @property
+    def writes_suppressed(self):
+        return self._n_writes_suppressed
+
+
+    @property
+    def shadow_cache_enabled(self):
+        return self._shadow_cache_enabled
+
+
+    def enable_shadow_cache(self, value = True):
+        self._shadow_cache_enabled = value
+        self.invalidate_shadow_cache()
+
+
+    def invalidate_shadow_cache(self):
+        self._registers_written = {}
+
+
+    @property
+    def _force_writes(self):
+        return not (self.in_transaction or self._shadow_cache_enabled)
+
+
+    def flush(self):
+        dirty_registers, self._dirty_registers = self._dirty_registers, {}
+        registers = [reg for reg in self._flush_order(dirty_registers)
+                     if dirty_registers[reg] or self._register_changed(reg)]
+        self._n_writes_suppressed -= len(registers)
+        self._commit_registers(registers)
+
+
     def _show_bus_data(self, bytes_array, address = None, reading = False):
         if self.DEBUG_MODE_SHOW_BUS_DATA:
-            print('\nAction: {}, {}: {}{}'.format(self._action,
+            print('\nAction: {}, {}: {}{}'.format(self.action,
                                                   'reading' if reading else 'writing',
                                                   hex(int.from_bytes(bytes_array, 'big')),
                                                   '' if address is None else ', Address: {}'.format(address)))
@@ -159,13 +401,71 @@ class DeviceBase:
 
     # =================================================================
 
-    def _write_register(self, register, reset = False):
+    def _write_register(self, register, reset = False, force = False):
         if reset:
             register.reset()
-        self._show_bus_data(register.bytes, address = register.address)
+        self._mark_dirty(register, force = force or self._force_writes)
+        if not self.in_transaction:
+            self.flush()
+
+
+    def _mark_dirty(self, register, force = False):
+        self._dirty_registers[register] = force or self._dirty_registers.get(register, False)
+        self._n_writes_suppressed += 1
+
+
+    def _flush_order(self, registers):
+        return list(registers)
+
+
+    def _register_value(self, register):
+        return register.value
+
+
+    def _register_changed(self, register):
+        return self._registers_written.get(register) != self._register_value(register)
+
+
+    def _register_words(self, register):
+        return (register.bytes,)
+
+
+    def _commit_registers(self, registers):
+        for reg in registers:
+            self._commit_register(reg)
+
+
+    def _commit_register(self, register):
+        self._registers_written[register] = self._register_value(register)
+        for bytes_array in self._register_words(register):
+            self._show_bus_data(bytes_array, address = register.address)
+            if self._bus_worker is None:
+                self._write_bus(bytes_array)
+            else:
+                self._bus_worker.submit(self._write_bus, bytes_array)
+            self._n_bus_writes += 1
         self._print_register(register)
 
 
+    def _write_bus(self, bytes_array):
+        # every word reaching the bus passes here; captures shadow it, so they run no hooks.
+        hooks = self._bus_hooks
+        if not hooks:
+            return self._write_bus_raw(bytes_array)
+
+        t0 = ticks_ns()
+        try:
+            return self._write_bus_raw(bytes_array)
+        finally:
+            ns = ticks_ns() - t0
+            for hook in hooks:
+                hook(bytes_array, ns)
+
+
+    def _write_bus_raw(self, bytes_array):
+        raise NotImplementedError()
+
+
     def _load_n_write_register(self, register, value):
         register.load_value(value)
         self._write_register(register)
@@ -191,8 +491,17 @@ class DeviceBase:
 
 
     def write_all_registers(self, reset = False):
-        for reg in self.map._registers:
-            self._write_register(reg, reset = reset)
+        # pushes every register, e.g. to re-sync the chip after a glitch.
+        self.invalidate_shadow_cache()
+        self._write_changed_registers(reset = reset)
+
+
+    def _write_changed_registers(self, reset = False):
+        # every register through the shadow cache, so only what differs from the chip is written.
+        force = self._force_writes
+        with self.transaction():
+            for reg in self.map._registers:
+                self._write_register(reg, reset = reset, force = force)
 
 
     def _read_register(self, register):
@@ -269,12 +578,12 @@ class Device(DeviceBase):
 
 
     def set_frequency(self, freq, idx = None, freq_correction = None):
-        self._action = 'set_frequency {} idx {}'.format(freq, idx)
+        self._trace('set_frequency', freq, idx)
         raise NotImplementedError()
 
 
     def set_phase(self, phase, idx = None):
-        self._action = 'set_phase {} idx {}'.format(phase, idx)
+        self._trace('set_phase', phase, idx)
         raise NotImplementedError()
 
 
@@ -307,5 +616,5 @@ class Device(DeviceBase):
 
 
     def enable_output_channel(self, idx, value = True):
-        self._action = 'enable_output_channel: {} {}'.format(idx, value)
+        self._trace('enable_output_channel', idx, value)
         raise NotImplementedError()
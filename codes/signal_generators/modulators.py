@@ -1,22 +1,53 @@
 # https://en.wikipedia.org/wiki/Quadrature_amplitude_modulation
 
 import time
+from array import array
 
+try:
+    from .instrumentation import LatencyHistogram
+    from .scheduler import SymbolScheduler, NS_PER_S, ticks_ns
+except:
+    from instrumentation import LatencyHistogram
+    from scheduler import SymbolScheduler, NS_PER_S, ticks_ns
 
 DEFAULT_CARRIER_FREQ = int(1e5)
 
 
 
+class TransmissionPlan:
+
+    def __init__(self, words, prologue, word_ids, step_starts, deadlines_ns, end_ns, epilogue):
+        self.words = words  # distinct bus words, referenced by index.
+        self.prologue = prologue
+        self.word_ids = word_ids
+        self.step_starts = step_starts  # step k writes word_ids[step_starts[k]:step_starts[k + 1]].
+        self.deadlines_ns = deadlines_ns
+        self.end_ns = end_ns
+        self.epilogue = epilogue
+
+
+    @property
+    def n_steps(self):
+        return len(self.deadlines_ns)
+
+
+    @property
+    def n_words(self):
+        return len(self.prologue) + len(self.word_ids) + len(self.epilogue)
+
+
+
 class Modulator:
     ON = 1
     OFF = 0
     SYMBOLS = (ON, OFF)
 
 
-    def __init__(self, device, freq = DEFAULT_CARRIER_FREQ, time_ratio = 1):
+    def __init__(self, device, freq = DEFAULT_CARRIER_FREQ, time_ratio = 1, scheduler = None):
         self._device = device
         self.freq = freq
         self.time_ratio = time_ratio
+        self.scheduler = SymbolScheduler() if scheduler is None else scheduler
         self.initialize()
 
 
@@ -68,13 +99,109 @@ class Modulator:
         self.enable_output(True)
 
         try:
-            for (symbol, duration) in sequence:
-                self.symbol = symbol
-                time.sleep(duration * self.time_ratio)
+            self.scheduler.run(sequence, self._emit_symbol, time_ratio = self.time_ratio)
         except KeyboardInterrupt:
             print('User interrupts.')
 
         self.enable_output(False)
+        return self.scheduler.stats()
+
+
+    def _emit_symbol(self, symbol):
+        self.symbol = symbol
+
+
+    def compile(self, sequence):
+        # records the bus words send_sequence would write, without writing them.
+        n_stateful_writes = self._device._n_stateful_writes
+        plan = self._compile(sequence, memoize = True)
+        if self._device._n_stateful_writes != n_stateful_writes:
+            # the words of a transition depended on earlier writes, so they cannot be reused.
+            plan = self._compile(sequence, memoize = False)
+        return plan
+
+
+    def _compile(self, sequence, memoize):
+        words = []
+        word_index = {}
+
+
+        def intern(captured):
+            ids = []
+            for w in captured:
+                key = bytes(w)
+                if key not in word_index:
+                    word_index[key] = len(words)
+                    words.append(w)
+                ids.append(word_index[key])
+            del captured[:]
+            return tuple(ids)
+
+
+        word_ids = array('H')
+        step_starts = array('I', [0])
+        deadlines_ns = []
+        deadline = 0
+        transitions = {}  # (previous symbol, symbol): word ids.
+
+        with self._device.capture_bus() as captured:
+            self.reset()
+            self.enable_output(True)
+            prologue = intern(captured)
+
+            previous = state = None
+            for (symbol, duration) in sequence:
+                ids = transitions.get((previous, symbol)) if memoize else None
+                if ids is None:
+                    if state != previous:
+                        self.symbol = previous
+                        del captured[:]
+                    self.symbol = symbol
+                    ids = transitions[(previous, symbol)] = intern(captured)
+                    state = symbol
+
+                word_ids.extend(ids)
+                step_starts.append(len(word_ids))
+                deadlines_ns.append(deadline)
+                deadline += int(duration * self.time_ratio * NS_PER_S)
+                previous = symbol
+
+            if state != previous:
+                self.symbol = previous
+                del captured[:]
+            self.enable_output(False)
+            epilogue = intern(captured)
+
+        self._device.invalidate_shadow_cache()
+        return TransmissionPlan(words, prologue, word_ids, step_starts, deadlines_ns, deadline, epilogue)
+
+
+    def play(self, plan):
+        write = self._device._bus_writer()
+        words = plan.words
+        word_ids = plan.word_ids
+        step_starts = plan.step_starts
+
+
+        def emit(k):
+            for i in range(step_starts[k], step_starts[k + 1]):
+                write(words[word_ids[i]])
+
+
+        for i in plan.prologue:
+            write(words[i])
+
+        try:
+            self.scheduler.run_at(plan.deadlines_ns, plan.end_ns, emit)
+        except KeyboardInterrupt:
+            print('User interrupts.')
+
+        for i in plan.epilogue:
+            write(words[i])
+
+        self._device._drain_bus_worker()
+        self._device.invalidate_shadow_cache()
+        return self.scheduler.stats()
 
 
 
@@ -118,7 +245,7 @@ class OOK(Modulator):
     FREQ_CARRIER = int(4e4)
 
 
-    def __init__(self, device, freq = FREQ_CARRIER, time_ratio = 500 / 517):
+    def __init__(self, device, freq = FREQ_CARRIER, time_ratio = 1):
         super().__init__(device, freq = freq, time_ratio = time_ratio)
 
 
@@ -207,8 +334,10 @@ class MultipleChannels:
     SYMBOLS = (ON, OFF)
 
 
-    def __init__(self, devices):
+    def __init__(self, devices, scheduler = None):
         self._devices = devices
+        self.scheduler = SymbolScheduler() if scheduler is None else scheduler
+        self.skew_ns = LatencyHistogram()
         self.initialize()
 
 
@@ -246,6 +375,49 @@ class MultipleChannels:
 
 
     def _process_symbol(self, symbol):
+        self.commit(self._channel_updates(symbol))
+
+
+    def commit(self, updates):
+        # encodes every channel first, then writes each bus's words back-to-back as one job on the thread owning it.
+        groups = []  # [(bus worker or None, [(write, words), ...])], channels sharing a worker in one group.
+        for (device, fun, kwargs) in updates:
+            with device.capture_bus() as words:
+                getattr(device, fun)(**kwargs)
+            if words:
+                worker = device.bus_worker
+                group = next((g for (w, g) in groups if w is worker), None)
+                if group is None:
+                    group = []
+                    groups.append((worker, group))
+                group.append((device._write_bus, words))
+
+        t_done = []
+
+
+        def write_group(group):
+            for (write, words) in group:
+                for bytes_array in words:
+                    write(bytes_array)
+                t_done.append(ticks_ns())
+
+
+        for (worker, group) in groups:
+            if worker is None:
+                write_group(group)
+            else:
+                worker.submit(write_group, group)  # one job: no other device's words land in between.
+        for (worker, _) in groups:
+            if worker is not None:
+                worker.drain()
+
+        skew = max(t_done) - min(t_done) if t_done else 0
+        self.skew_ns.record(skew)
+        return skew
+
+
+    def _channel_updates(self, symbol):
+        # [(device, method name, kwargs), ...], one per channel.
         raise NotImplementedError
 
 
@@ -262,13 +434,16 @@ class MultipleChannels:
         self.enable_output(True)
 
         try:
-            for (symbol, duration) in sequence:
-                self.symbol = symbol
-                time.sleep(duration)
+            self.scheduler.run(sequence, self._emit_symbol)
         except KeyboardInterrupt:
             print('User interrupts.')
 
         self.enable_output(False)
+        return self.scheduler.stats()
+
+
+    def _emit_symbol(self, symbol):
+        self.symbol = symbol
 
 
 
@@ -288,7 +463,10 @@ class IQ(MultipleChannels):
     IDX_Q = 1
 
 
-    def __init__(self, devices, freq = DEFAULT_CARRIER_FREQ, phase_on = PHASE_ON, phase_off = PHASE_OFF):
+    def __init__(self, devices, freq = DEFAULT_CARRIER_FREQ, phase_on = PHASE_ON, phase_off = PHASE_OFF,
+                 scheduler = None):
+        self.scheduler = SymbolScheduler() if scheduler is None else scheduler
+        self.skew_ns = LatencyHistogram()
         self._devices = (BPSK(devices[0], freq = freq, phase_on = phase_on, phase_off = phase_off),
                          BPSK(devices[1], freq = freq,
                               phase_on = phase_on + self.QUADRATURE,
@@ -305,9 +483,9 @@ class IQ(MultipleChannels):
             d.initialize()
 
 
-    def _process_symbol(self, symbol):
-        self._devices[self.IDX_I].select_phase_source(idx = (symbol >> 1) & 0x01)
-        self._devices[self.IDX_Q].select_phase_source(idx = (symbol >> 0) & 0x01)
+    def _channel_updates(self, symbol):
+        return [(self._devices[self.IDX_I]._device, 'select_phase_source', {'idx': (symbol >> 1) & 0x01}),
+                (self._devices[self.IDX_Q]._device, 'select_phase_source', {'idx': (symbol >> 0) & 0x01})]
 
 
 
@@ -342,9 +520,11 @@ class DTMF(MultipleChannels):
     IDX_FREQ_COLUMN = 1
 
 
-    def _process_symbol(self, symbol):
-        self._devices[self.IDX_FREQ_ROW].set_frequency(freq = self.TONES[symbol][self.IDX_FREQ_ROW])
-        self._devices[self.IDX_FREQ_COLUMN].set_frequency(freq = self.TONES[symbol][self.IDX_FREQ_COLUMN])
+    def _channel_updates(self, symbol):
+        return [(self._devices[self.IDX_FREQ_ROW], 'set_frequency',
+                 {'freq': self.TONES[symbol][self.IDX_FREQ_ROW]}),
+                (self._devices[self.IDX_FREQ_COLUMN], 'set_frequency',
+                 {'freq': self.TONES[symbol][self.IDX_FREQ_COLUMN]})]
 
 
 
@@ -0,0 +1,61 @@
+from array import array
+
+_codecs = {}
+
+
+
+class RegisterCodec:
+
+    def __init__(self, fields, n_bytes, byteorder = 'big'):
+        self.fields = tuple(fields)  # (name, idx_lowest_bit, n_bits)
+        self.n_bytes = n_bytes
+        self.byteorder = byteorder
+
+        self.shifts = {name: shift for (name, shift, _) in self.fields}
+        self.masks = {name: 2 ** n_bits - 1 for (name, _, n_bits) in self.fields}
+        self._byte_shifts = tuple(8 * i for i in range(n_bytes))
+        if byteorder == 'big':
+            self._byte_shifts = self._byte_shifts[::-1]
+
+
+    @classmethod
+    def of(cls, register, byteorder = 'big'):
+        # keyed by the layout, so registers sharing a name but not their fields get their own codec.
+        fields = tuple((e.name, e.idx_lowest_bit, e.n_bits) for e in register._elements)
+        key = (fields, register.n_bytes, byteorder)
+        codec = _codecs.get(key)
+        if codec is None:
+            codec = cls(fields, register.n_bytes, byteorder = byteorder)
+            _codecs[key] = codec
+        return codec
+
+
+    def get(self, word, name):
+        return (word >> self.shifts[name]) & self.masks[name]
+
+
+    def set(self, word, name, value):
+        shift = self.shifts[name]
+        mask = self.masks[name]
+        return (word & ~(mask << shift)) | ((value & mask) << shift)
+
+
+    def pack(self, values, word = 0):
+        for name, value in values.items():
+            word = self.set(word, name, value)
+        return word
+
+
+    def unpack(self, word):
+        return {name: (word >> shift) & self.masks[name] for (name, shift, _) in self.fields}
+
+
+    def to_bytes(self, word):
+        return array('B', [(word >> shift) & 0xFF for shift in self._byte_shifts])
+
+
+    def from_bytes(self, bytes_array):
+        word = 0
+        for (b, shift) in zip(bytes_array, self._byte_shifts):
+            word |= b << shift
+        return word
@@ -0,0 +1,108 @@
+import time
+
+
+try:
+    _ticks = time.perf_counter_ns
+    NS_PER_TICK = 1
+
+
+    def _ticks_diff(a, b):
+        return a - b
+
+except AttributeError:  # MicroPython
+    _ticks = time.ticks_us
+    _ticks_diff = time.ticks_diff
+    NS_PER_TICK = 1000
+
+NS_PER_S = 1000000000
+
+
+
+def ticks_ns():
+    return _ticks() * NS_PER_TICK
+
+
+
+def _sleep_ns(ns):
+    time.sleep(ns / NS_PER_S)
+
+
+
+class SymbolScheduler:
+    SPIN_NS = 500000  # busy-wait the last 0.5 ms before a deadline.
+    LATENCY_WEIGHT = 0.25  # weight of the newest sample in the write latency estimate.
+
+
+    def __init__(self, spin_ns = SPIN_NS, compensate_latency = True, latency_weight = LATENCY_WEIGHT):
+        self.spin_ns = spin_ns
+        self.compensate_latency = compensate_latency
+        self.latency_weight = latency_weight
+        self.reset()
+
+
+    def reset(self):
+        self._t0 = _ticks()
+        self.latency_ns = 0
+        self.errors_ns = []
+
+
+    def now_ns(self):
+        return _ticks_diff(_ticks(), self._t0) * NS_PER_TICK
+
+
+    def wait_until(self, deadline_ns):
+        remaining = deadline_ns - self.now_ns()
+        if remaining > self.spin_ns:
+            _sleep_ns(remaining - self.spin_ns)
+        if self.spin_ns:
+            while self.now_ns() < deadline_ns:
+                pass
+        else:
+            remaining = deadline_ns - self.now_ns()
+            if remaining > 0:
+                _sleep_ns(remaining)
+
+
+    def run(self, sequence, emit, time_ratio = 1):
+        symbols = []
+        deadlines_ns = []
+        deadline = 0
+        for (symbol, duration) in sequence:
+            symbols.append(symbol)
+            deadlines_ns.append(deadline)
+            deadline += int(duration * time_ratio * NS_PER_S)
+
+        self.run_at(deadlines_ns, deadline, lambda k: emit(symbols[k]))
+
+
+    def run_at(self, deadlines_ns, end_ns, emit):
+        # step k is due at deadlines_ns[k]; it is emitted early by the estimated write latency.
+        self.reset()
+
+        for k in range(len(deadlines_ns)):
+            deadline = deadlines_ns[k]
+            self.wait_until(deadline - (self.latency_ns if self.compensate_latency else 0))
+
+            t_start = self.now_ns()
+            emit(k)
+            t_done = self.now_ns()
+
+            self.errors_ns.append(t_done - deadline)
+            self.latency_ns += self.latency_weight * (t_done - t_start - self.latency_ns)
+
+        self.wait_until(end_ns)
+
+
+    def stats(self):
+        errors = self.errors_ns
+        n = len(errors)
+        if n == 0:
+            return {'count': 0}
+
+        mean = sum(errors) / n
+        return {'count'      : n,
+                'mean_ns'    : mean,
+                'std_ns'     : (sum((e - mean) ** 2 for e in errors) / n) ** 0.5,
+                'min_ns'     : min(errors),
+                'max_ns'     : max(errors),
+                'latency_ns' : self.latency_ns}
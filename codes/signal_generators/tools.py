@@ -2,6 +2,12 @@ import math
 import random
 import time
 
+try:
+    from .instrumentation import LatencyHistogram
+    from .scheduler import SymbolScheduler, NS_PER_S
+except:
+    from instrumentation import LatencyHistogram
+    from scheduler import SymbolScheduler, NS_PER_S
 
 
 class ToolBox:
@@ -12,25 +18,69 @@ class ToolBox:
     @classmethod
     def sweep(cls, device, freq_start = 10, freq_end = int(1e6), n_freqs = 500,
               sweep_type = SWEEP_TYPES[0], direction = SWEEP_DIRECTIONS[0], n_cycles = None,
-              slot_duration = 0.01, between_cycle_seconds = 1):
+              slot_duration = 0.01, between_cycle_seconds = 1, verbose = True):
+        # returns the frequencies in the order the next cycle would play them.
+        freqs = list(cls.sweep_frequencies(freq_start, freq_end, n_freqs, sweep_type))
 
-        if sweep_type == 'linear':
-            start = freq_start
-            step = (freq_end - freq_start) / n_freqs
-            freqs = [(start + i * step) for i in range(n_freqs)]
-        else:
-            start = math.log10(freq_start)
-            step = math.log10(freq_end / freq_start) / n_freqs
-            freqs = [10 ** (start + i * step) for i in range(n_freqs)]
+        def play_cycle(reverse):
+            return cls.play(device, cls.encode(device, freqs[::-1] if reverse else freqs), slot_duration,
+                            verbose = verbose)
+
+        _, reverse = cls._run_cycles(device, play_cycle, direction, n_cycles, between_cycle_seconds)
+        return freqs[::-1] if reverse else freqs
+
+
+    @classmethod
+    def stream_sweep(cls, device, freq_start = 10, freq_end = int(1e6), n_freqs = 500,
+                     sweep_type = SWEEP_TYPES[0], direction = SWEEP_DIRECTIONS[0], n_cycles = None,
+                     slot_duration = 0.01, between_cycle_seconds = 1, resolution = None, quantize = True,
+                     verbose = False):
+        # source -> quantizer -> encoder -> timed sink, one point at a time, so memory does not grow with n_freqs.
+        # the quantizer rounds to resolution, the device's freq_resolution by default; quantize = False skips it.
+        lateness_ns = LatencyHistogram()
+
+        def play_cycle(reverse):
+            freqs = cls.sweep_frequencies(freq_start, freq_end, n_freqs, sweep_type, reverse = reverse)
+            if quantize:
+                freqs = cls.quantize(freqs, device.freq_resolution if resolution is None else resolution)
+            return cls.play(device, cls.encode(device, freqs), slot_duration,
+                            lateness_ns = lateness_ns, verbose = verbose)
+
+        n_steps, _ = cls._run_cycles(device, play_cycle, direction, n_cycles, between_cycle_seconds)
+        return {'n_steps': n_steps, 'lateness_ns': lateness_ns.summary()}
 
-        if direction == 'down':
-            freqs = freqs[::-1]
 
+    @classmethod
+    def compact_sweep(cls, device, freq_start = 10, freq_end = int(1e6), n_freqs = 500,
+                      sweep_type = SWEEP_TYPES[0], direction = SWEEP_DIRECTIONS[0], n_cycles = None,
+                      slot_duration = 0.01, between_cycle_seconds = 1, verbose = False):
+        # quantizes the whole grid to the device's tuning up front and retunes only when the tuning changes,
+        # dwelling on each emitted frequency for as many slots as it stands for.
+        freqs, dwell_s = cls.dedup_sweep(device, cls.sweep_grid(freq_start, freq_end, n_freqs, sweep_type),
+                                         slot_duration)
+        lateness_ns = LatencyHistogram()
+
+        def play_cycle(reverse):
+            (f, d) = (freqs[::-1], dwell_s[::-1]) if reverse else (freqs, dwell_s)
+            return cls.play(device, cls.encode(device, f.tolist()), d.tolist(),
+                            lateness_ns = lateness_ns, verbose = verbose)
+
+        n_steps, _ = cls._run_cycles(device, play_cycle, direction, n_cycles, between_cycle_seconds)
+        return {'n_requested': n_freqs, 'n_steps': n_steps, 'freqs': freqs, 'dwell_s': dwell_s,
+                'lateness_ns': lateness_ns.summary()}
+
+
+    @staticmethod
+    def _run_cycles(device, play_cycle, direction, n_cycles, between_cycle_seconds):
+        # (steps played, whether the next cycle would play reversed).
         (cycles_remains, need_to_count_down) = (1, False) if n_cycles is None else (n_cycles, True)
 
         if direction == 'round_trip':
             cycles_remains *= 2
 
+        reverse = direction == 'down'
+        n_steps = 0
+
         device.reset()
 
         try:
@@ -40,16 +90,11 @@ class ToolBox:
                     cycles_remains -= 1
 
                 device.enable_output(True)
-
-                for freq in freqs:
-                    print('Frequency: {:>10.2f}'.format(freq))
-                    device.set_frequency(freq = freq)
-                    time.sleep(slot_duration)
-
+                n_steps += play_cycle(reverse)
                 device.enable_output(False)
 
                 if direction == 'round_trip':
-                    freqs = freqs[::-1]
+                    reverse = not reverse
 
                 time.sleep(between_cycle_seconds)
 
@@ -58,7 +103,92 @@ class ToolBox:
 
         device.enable_output(False)
 
-        return freqs
+        return n_steps, reverse
+
+
+    @classmethod
+    def sweep_grid(cls, freq_start, freq_end, n_freqs, sweep_type = SWEEP_TYPES[0]):
+        # sweep_frequencies as an array.
+        import numpy as np
+
+        start, step, linear = cls._sweep_axis(freq_start, freq_end, n_freqs, sweep_type)
+        x = start + np.arange(n_freqs) * step
+        return x if linear else 10 ** x
+
+
+    @staticmethod
+    def dedup_sweep(device, freqs, slot_duration):
+        # collapses consecutive frequencies the device would tune identically: (emitted frequencies, dwell times).
+        import numpy as np
+
+        keys, freqs_achieved = device.quantize_frequencies(freqs)
+        if len(keys) == 0:
+            return freqs_achieved, np.zeros(0)
+
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        dwell_s = np.diff(np.append(starts, len(keys))) * slot_duration
+        return freqs_achieved[starts], dwell_s
+
+
+    @classmethod
+    def sweep_frequencies(cls, freq_start, freq_end, n_freqs, sweep_type = SWEEP_TYPES[0], reverse = False):
+        start, step, linear = cls._sweep_axis(freq_start, freq_end, n_freqs, sweep_type)
+
+        for i in (range(n_freqs - 1, -1, -1) if reverse else range(n_freqs)):
+            yield (start + i * step) if linear else 10 ** (start + i * step)
+
+
+    @staticmethod
+    def _sweep_axis(freq_start, freq_end, n_freqs, sweep_type = SWEEP_TYPES[0]):
+        # (start, step, linear): point i is start + i * step, or 10 ** (start + i * step) on a logarithm sweep.
+        if sweep_type == 'linear':
+            return freq_start, (freq_end - freq_start) / n_freqs, True
+        return math.log10(freq_start), math.log10(freq_end / freq_start) / n_freqs, False
+
+
+    @staticmethod
+    def quantize(freqs, resolution):
+        for freq in freqs:
+            yield round(freq / resolution) * resolution
+
+
+    @staticmethod
+    def encode(device, freqs):
+        # the bus words for each frequency, captured without writing them.
+        for freq in freqs:
+            with device.capture_bus() as words:
+                device.set_frequency(freq = freq)
+            yield freq, words
+
+
+    @staticmethod
+    def play(device, encoded, slot_duration, scheduler = None, lateness_ns = None, verbose = False):
+        # writes each step's words at its deadline; the next step is encoded while waiting.
+        # slot_duration is either one duration for every step or a sequence of per step durations.
+        scheduler = SymbolScheduler() if scheduler is None else scheduler
+        scheduler.reset()
+        write = device._bus_writer()
+        durations = iter(slot_duration) if hasattr(slot_duration, '__iter__') else None
+        slot_ns = 0 if durations else int(slot_duration * NS_PER_S)
+        deadline = 0
+        n_steps = 0
+
+        for (freq, words) in encoded:
+            if durations:
+                slot_ns = int(next(durations) * NS_PER_S)
+            scheduler.wait_until(deadline)
+            for bytes_array in words:
+                write(bytes_array)
+            if lateness_ns is not None:
+                lateness_ns.record(scheduler.now_ns() - deadline)
+            if verbose:
+                print('Frequency: {:>10.2f}'.format(freq))
+            deadline += slot_ns
+            n_steps += 1
+
+        scheduler.wait_until(deadline)
+        device._drain_bus_worker()
+        return n_steps
 
 
     @classmethod
@@ -0,0 +1,168 @@
+from array import array
+
+try:
+    from .scheduler import SymbolScheduler, ticks_ns
+except:
+    from scheduler import SymbolScheduler, ticks_ns
+
+
+
+def format_action(event):
+    if event is None:
+        return ''
+    op, args = event
+    return ' '.join([op] + [str(arg) for arg in args])
+
+
+
+class ActionTrace:
+    SIZE = 64
+
+
+    def __init__(self, size = SIZE):
+        self._events = [None] * size
+        self._idx = 0
+        self.n_events = 0
+
+
+    @property
+    def size(self):
+        return len(self._events)
+
+
+    def record(self, event):
+        self._events[self._idx] = event
+        self._idx = (self._idx + 1) % len(self._events)
+        self.n_events += 1
+
+
+    def clear(self):
+        self._events = [None] * self.size
+        self._idx = 0
+        self.n_events = 0
+
+
+    @property
+    def events(self):
+        # oldest first.
+        events = self._events[self._idx:] + self._events[:self._idx]
+        return [e for e in events if e is not None]
+
+
+    def dump(self):
+        for event in self.events:
+            print(format_action(event))
+
+
+
+class BusTrace:
+    SIZE = 4096
+    DTYPE = [('timestamp_ns', '<i8'), ('device', '<u2'), ('address', '<i2'), ('n_bytes', 'u1'), ('word', '<u8')]
+
+
+    def __init__(self, size = SIZE):
+        self._timestamps = array('q', [0] * size)
+        self._devices = array('H', [0] * size)
+        self._addresses = array('h', [0] * size)
+        self._n_bytes = array('B', [0] * size)
+        self._words = array('Q', [0] * size)
+        self._idx = 0
+        self.n_events = 0
+        self.device_names = []
+
+
+    @property
+    def size(self):
+        return len(self._words)
+
+
+    def __len__(self):
+        return min(self.n_events, self.size)
+
+
+    def register(self, device):
+        self.device_names.append('{}_{}'.format(device.__class__.__name__, len(self.device_names)))
+        return len(self.device_names) - 1
+
+
+    def record(self, device_id, address, bytes_array):
+        i = self._idx
+        self._timestamps[i] = ticks_ns()
+        self._devices[i] = device_id
+        self._addresses[i] = -1 if address is None else address
+        self._n_bytes[i] = len(bytes_array)
+        self._words[i] = int.from_bytes(bytes_array, 'big')
+        self._idx = (i + 1) % len(self._words)
+        self.n_events += 1
+
+
+    def clear(self):
+        self._idx = 0
+        self.n_events = 0
+
+
+    def _order(self):
+        # indices oldest first.
+        if self.n_events <= self.size:
+            return range(self.n_events)
+        return [(self._idx + i) % self.size for i in range(self.size)]
+
+
+    @property
+    def events(self):
+        return [(self._timestamps[i], self._devices[i], self._addresses[i], self._n_bytes[i], self._words[i])
+                for i in self._order()]
+
+
+    def to_numpy(self):
+        import numpy as np
+
+        order = np.asarray(self._order(), dtype = np.intp)
+        events = np.empty(len(order), dtype = self.DTYPE)
+        for name, column in zip(events.dtype.names,
+                                (self._timestamps, self._devices, self._addresses, self._n_bytes, self._words)):
+            events[name] = np.frombuffer(column, dtype = column.typecode)[order]
+        return events
+
+
+    def save(self, path):
+        import numpy as np
+
+        np.savez_compressed(path, events = self.to_numpy(), devices = np.array(self.device_names))
+
+
+    @staticmethod
+    def load(path):
+        import numpy as np
+
+        with np.load(path) as f:
+            return f['events'], [str(name) for name in f['devices']]
+
+
+
+def word_bytes(word, n_bytes):
+    return array('B', [(word >> (8 * i)) & 0xFF for i in range(n_bytes - 1, -1, -1)])
+
+
+
+def replay(events, buses, scheduler = None, timed = True):
+    # events: BusTrace.events or a loaded NumPy trace; buses: device id -> object with write(bytes_array).
+    steps = [(int(t), buses[int(device)], word_bytes(int(word), int(n_bytes)))
+             for (t, device, _, n_bytes, word) in events]
+
+    if not timed:
+        for (_, bus, bytes_array) in steps:
+            bus.write(bytes_array)
+        return None
+
+    t0 = steps[0][0] if steps else 0
+    scheduler = SymbolScheduler() if scheduler is None else scheduler
+
+
+    def emit(k):
+        _, bus, bytes_array = steps[k]
+        bus.write(bytes_array)
+
+
+    scheduler.run_at([t - t0 for (t, _, _) in steps], steps[-1][0] - t0 if steps else 0, emit)
+    return scheduler.stats()
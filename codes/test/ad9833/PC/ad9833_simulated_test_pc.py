@@ -0,0 +1,274 @@
+import asyncio
+import gc
+import threading
+import weakref
+
+from signal_generators.ad98xx.ad9833 import *
+from signal_generators.ad98xx.ad9850 import AD9850
+from signal_generators.ad98xx.word_stream import WordStream
+from signal_generators.async_device import AsyncDevice, async_device
+from signal_generators.bus_workers import BusWorker, BusMultiplexer
+from signal_generators.buses import SimulatedBus, AD98xxDecoder, AD9850Decoder
+from signal_generators.modulators import BPSK, DTMF
+from signal_generators.tools import ToolBox
+from signal_generators.tracing import BusTrace
+
+
+# runs without hardware: an AD9833 on a SimulatedBus, which decodes what is written.
+
+
+
+def simulated_ad9833(keep_writes = True):
+    bus = SimulatedBus(AD98xxDecoder(), keep_writes = keep_writes)
+    return bus, AD9833(bus = bus)
+
+
+
+def hold(worker, seconds = 0.05):
+    # the worker writes nothing for a while, so anything bypassing its queue would land first.
+    gate = threading.Event()
+    worker.submit(lambda _: gate.wait(), None)
+    threading.Timer(seconds, gate.set).start()
+
+
+
+def test_bus_trace_records_bus_writes_only():
+    bus, ad = simulated_ad9833()
+    trace = BusTrace()
+    ad.attach_bus_trace(trace)
+
+    modulator = BPSK(ad)
+    modulator.scheduler.spin_ns = 0
+    trace.clear()
+    bus.reset_counters()
+    plan = modulator.compile([(i & 1, 0) for i in range(50)])
+    assert bus.n_transfers == 0 and len(trace) == 0, 'compiling writes nothing, so traces nothing.'
+
+    modulator.play(plan)
+    assert len(trace) == bus.n_transfers > 0
+    assert [w for (_, _, _, _, w) in trace.events] == [int.from_bytes(b, 'big') for b in bus.writes]
+    assert set(a for (_, _, a, _, _) in trace.events) == {0, 1, 2, 3, 4}  # the prologue writes every register.
+
+    trace.clear()
+    bus.reset_counters()
+    ad.play_trajectory(ad.compile_trajectory([1000, 2000, 3000], 1e6))
+    assert len(trace) == bus.n_transfers > 0
+    assert [a for (_, _, a, _, _) in trace.events] == [0, 2, 2, 0, 1, 1, 0, 2, 2, 0]  # B28, then ping-pong.
+
+    ad.attach_bus_trace(None)
+    trace.clear()
+    ad.set_frequency(1234)
+    assert len(trace) == 0
+
+
+
+def test_frequency_tables_share_the_ad98xx_interface():
+    freqs = [1000.3, 12345.6]
+    for device in (simulated_ad9833()[1], AD9850(SimulatedBus(AD9850Decoder()), None)):
+        words, freqs_achieved = device.quantize_frequencies(freqs)
+        assert all(abs(f - w * device.freq_resolution) < 1e-6 for (w, f) in zip(words, freqs_achieved))
+        assert device.frequency_table(freqs, 0)['freq'].tolist() == freqs
+
+
+
+def test_instrumentation_times_fast_paths():
+    bus, ad = simulated_ad9833()
+    modulator = BPSK(ad)
+    modulator.scheduler.spin_ns = 0
+    plan = modulator.compile([(i & 1, 0) for i in range(50)])
+
+    ad.enable_instrumentation()
+    bus.reset_counters()
+    modulator.play(plan)
+    ad.play_trajectory(ad.compile_trajectory([1000, 2000, 3000], 1e6))
+
+    stats = ad.stats()
+    assert stats['bus_io']['_write_bus']['count'] == bus.n_transfers
+    assert stats['play_trajectory']['calls'] == 1
+    ad.enable_instrumentation(False)
+
+
+
+def test_async_devices_do_not_outlive_their_device():
+    bus, ad = simulated_ad9833(keep_writes = False)
+    wrapper = async_device(ad)
+    assert async_device(ad) is wrapper
+    asyncio.run(wrapper.set_frequency(1000))
+    assert AsyncDevice.executor_for(bus) in AsyncDevice._executors.values()
+
+    device_ref = weakref.ref(ad)
+    bus_ref = weakref.ref(bus)
+    del bus, ad, wrapper
+    gc.collect()
+    assert device_ref() is None and bus_ref() is None
+    assert len(AsyncDevice._executors) == 0
+
+
+
+def test_bus_trace_and_instrumentation_detach_in_any_order():
+    for detach_trace_first in (True, False):
+        bus, ad = simulated_ad9833()
+        trace = BusTrace()
+        ad.attach_bus_trace(trace)
+        ad.enable_instrumentation()
+
+        if detach_trace_first:
+            ad.attach_bus_trace(None)
+        else:
+            ad.enable_instrumentation(False)
+
+        trace.clear()
+        ad.set_frequency(1000)
+        if detach_trace_first:
+            assert len(trace) == 0 and ad.stats()['bus_io']['_write_bus']['count'] > 0
+            ad.enable_instrumentation(False)
+        else:
+            assert len(trace) > 0 and ad.stats() == {}
+            ad.attach_bus_trace(None)
+
+        trace.clear()
+        ad.set_frequency(2000)
+        assert len(trace) == 0 and ad._bus_hooks == ()
+        assert '_write_bus' not in ad.__dict__
+
+
+
+def test_write_all_registers_pushes_every_register():
+    bus, ad = simulated_ad9833()
+    bus.reset_counters()
+    ad.write_all_registers()
+    assert bus.n_transfers == 7  # control, two words for each FREQ register, then each PHASE register.
+
+
+
+def test_play_paths_write_behind_bus_worker():
+    writes = []
+    for with_worker in (False, True):
+        bus, ad = simulated_ad9833()
+        modulator = BPSK(ad)
+        modulator.scheduler.spin_ns = 0
+        worker = BusWorker()
+        worker.start()
+        if with_worker:
+            ad.attach_bus_worker(worker)
+
+        def play_after_set_frequency(freq, play):
+            hold(worker)
+            ad.set_frequency(freq)
+            play()
+            assert ad.bus_worker is None or ad.bus_worker.pending == 0, 'play returns once its words are written.'
+
+        plan = modulator.compile([(i & 1, 0) for i in range(20)])
+        play_after_set_frequency(1000, lambda: modulator.play(plan))
+        stream = WordStream.from_plan(modulator.compile([(i & 1, 0) for i in range(20)]), device = ad)
+        play_after_set_frequency(2000, lambda: stream.play(ad))
+        trajectory = ad.compile_trajectory([1000, 2000, 3000], 1e6)
+        play_after_set_frequency(3000, lambda: ad.play_trajectory(trajectory))
+        play_after_set_frequency(4000, lambda: ToolBox.play(ad, ToolBox.encode(ad, [5000, 6000]), 1e-4))
+
+        worker.stop()
+        writes.append(list(bus.writes))
+
+    assert writes[0] == writes[1]
+
+
+
+def test_channels_commit_after_queued_writes():
+    writes = []
+    for with_workers in (False, True):
+        bus = SimulatedBus(AD98xxDecoder(), keep_writes = True)
+        devices = (AD9833(bus = bus), AD9833(bus = bus))
+        multiplexer = BusMultiplexer()
+        if with_workers:
+            multiplexer.attach(*devices)
+        dtmf = DTMF(devices)
+
+        threads = set()
+        for device in devices:
+            device.add_bus_hook(lambda bytes_array, ns: threads.add(threading.current_thread()))
+
+        for symbol in '15#':
+            hold(multiplexer.worker_for(bus))
+            devices[0].set_frequency(100)
+            dtmf.symbol = symbol
+
+        if with_workers:
+            assert threads == {multiplexer.worker_for(bus)}, 'only the worker owning the bus writes it.'
+        multiplexer.stop()
+        writes.append(list(bus.writes))
+
+    assert writes[0] == writes[1]
+
+
+
+def test_sweep_grid_matches_sweep_frequencies():
+    for sweep_type in ToolBox.SWEEP_TYPES:
+        grid = ToolBox.sweep_grid(10, 1e6, 50, sweep_type)
+        freqs = list(ToolBox.sweep_frequencies(10, 1e6, 50, sweep_type))
+        assert all(abs(g - f) <= 1e-12 * f for (g, f) in zip(grid, freqs)) and len(grid) == len(freqs)
+
+
+
+def test_sweep_returns_frequencies_in_next_cycle_order():
+    bus, ad = simulated_ad9833(keep_writes = False)
+    up = [10.0, 100.0, 1000.0, 10000.0]  # logarithm sweep of 10 Hz - 100 KHz, 4 points.
+
+    def sweep(direction, n_cycles):
+        return ToolBox.sweep(ad, freq_start = 10, freq_end = int(1e5), n_freqs = 4, direction = direction,
+                             n_cycles = n_cycles, slot_duration = 0, between_cycle_seconds = 0, verbose = False)
+
+    assert sweep('up', 1) == up and sweep('up', 0) == up
+    assert sweep('down', 1) == up[::-1] and sweep('down', 0) == up[::-1]
+    assert sweep('round_trip', 1) == up  # up, then down.
+    assert abs(ad.frequency_registers[ad.active_freq_reg_idx].frequency - up[0]) < 1  # the last one played.
+
+
+
+def test_stream_sweep_quantizes_to_device_resolution():
+    bus, ad = simulated_ad9833(keep_writes = False)
+    set_frequency = ad.set_frequency
+    freqs = []
+
+    def recording_set_frequency(freq, **kwargs):
+        freqs.append(freq)
+        return set_frequency(freq, **kwargs)
+
+    ad.set_frequency = recording_set_frequency
+    sweep = dict(freq_start = 1000, freq_end = 2000, n_freqs = 7, n_cycles = 1, slot_duration = 0,
+                 between_cycle_seconds = 0)
+
+    ToolBox.stream_sweep(ad, **sweep)
+    assert freqs == [round(f / ad.freq_resolution) * ad.freq_resolution
+                     for f in ToolBox.sweep_frequencies(1000, 2000, 7)]
+
+    freqs.clear()
+    ToolBox.stream_sweep(ad, quantize = False, **sweep)
+    assert freqs == list(ToolBox.sweep_frequencies(1000, 2000, 7))
+    del ad.set_frequency
+
+
+
+def test_trajectory_stream_after_partial_update():
+    bus, ad = simulated_ad9833()
+    ad.set_frequency(1000)
+    ad.set_frequency(1001)
+    assert bus.decoder.control_bit('B28') and ad._n_stateful_writes == 0, 'partial updates are opt-in.'
+
+    ad.enable_partial_updates()
+    ad.set_frequency(1002)  # a 14 LSBs only change: written with B28 = 0.
+    assert not bus.decoder.control_bit('B28')
+
+    trajectory = ad.compile_trajectory([5000, 7000, 9000], 1e6)
+    stream = WordStream.from_trajectory(trajectory, device = ad)
+    assert stream.n_prologue == 1
+
+    stream.play(ad)
+    assert abs(bus.decoder.frequency() - trajectory.freqs[-1]) < 1
+
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{}: ok'.format(name))
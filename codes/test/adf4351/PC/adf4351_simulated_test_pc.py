@@ -0,0 +1,36 @@
+from signal_generators.adf435x.adf4351 import ADF4351
+from signal_generators.buses import SimulatedBus, ADF4351Decoder
+
+
+# runs without hardware: an ADF4351 on a SimulatedBus, which decodes what is written.
+
+
+
+def simulated_adf4351(keep_writes = True):
+    bus = SimulatedBus(ADF4351Decoder(), keep_writes = keep_writes)
+    return bus, ADF4351(bus = bus)
+
+
+
+def test_write_all_registers_pushes_every_register():
+    bus, adf = simulated_adf4351()
+    bus.reset_counters()
+    adf.write_all_registers()
+    assert [b[-1] & 0x7 for b in bus.writes] == [5, 4, 3, 2, 1, 0]  # R0 last, it latches the double buffers.
+
+
+
+def test_set_frequency_writes_changed_registers_only():
+    bus, adf = simulated_adf4351()
+    adf.set_frequency(1.5002e9, channel_resolution = 100e3)
+    bus.reset_counters()
+    adf.set_frequency(1.5004e9, channel_resolution = 100e3)
+    assert 0 < bus.n_transfers < 7
+
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{}: ok'.format(name))
@@ -0,0 +1,251 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from signal_generators.ad98xx import AD9833, AD9834, AD9850
+from signal_generators.adf435x import ADF4351
+from signal_generators.adf435x.frequency_plan import FrequencyPlan, plan_frequencies, find_integer_n_plans
+from signal_generators.buses import CountingBus
+from signal_generators.modulators import BFSK, BPSK
+
+
+MIN_TIME = 0.2  # seconds per round.
+ROUNDS = 5
+THRESHOLD = 0.1  # a drop in ops/s beyond this ratio is reported as a regression.
+
+BENCHMARKS = {}
+
+
+
+def benchmark(name):
+    # the decorated function builds the device(s) and returns (bus, operation, ops per call to operation).
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+
+def _ad98xx(cls):
+    bus = CountingBus()
+    device = cls(bus = bus, pin_reset = None) if cls is AD9850 else cls(bus = bus)
+    return bus, device
+
+
+
+def _alternate(values):
+    state = {'i': 0}
+
+    def next_value():
+        state['i'] += 1
+        return values[state['i'] % len(values)]
+
+    return next_value
+
+
+
+for _cls in (AD9833, AD9834, AD9850):
+
+    @benchmark('{}.set_frequency'.format(_cls.__name__))
+    def _set_frequency(cls = _cls):
+        bus, device = _ad98xx(cls)
+        freq = _alternate((1000, 2000))
+        return bus, lambda: device.set_frequency(freq()), 1
+
+
+    @benchmark('{}.set_phase'.format(_cls.__name__))
+    def _set_phase(cls = _cls):
+        bus, device = _ad98xx(cls)
+        phase = _alternate((0, 90))
+        return bus, lambda: device.set_phase(phase()), 1
+
+
+    @benchmark('{}.reset'.format(_cls.__name__))
+    def _reset(cls = _cls):
+        bus, device = _ad98xx(cls)
+        return bus, device.reset, 1
+
+for _cls in (AD9833, AD9834):
+
+    @benchmark('{}.shape'.format(_cls.__name__))
+    def _shape(cls = _cls):
+        bus, device = _ad98xx(cls)
+        shape = _alternate(('sine', 'triangle'))
+
+        def set_shape():
+            device.shape = shape()
+
+        return bus, set_shape, 1
+
+
+    @benchmark('{}.BFSK.symbol'.format(_cls.__name__))
+    def _bfsk_symbol(cls = _cls):
+        bus, device = _ad98xx(cls)
+        modulator = BFSK(device)
+        symbol = _alternate(BFSK.SYMBOLS)
+
+        def send():
+            modulator.symbol = symbol()
+
+        return bus, send, 1
+
+
+    @benchmark('{}.BPSK.play'.format(_cls.__name__))
+    def _bpsk_play(cls = _cls):
+        bus, device = _ad98xx(cls)
+        modulator = BPSK(device)
+        modulator.scheduler.spin_ns = 0
+        n_symbols = 1000
+        plan = modulator.compile([(i & 1, 0) for i in range(n_symbols)])
+        return bus, lambda: modulator.play(plan), n_symbols
+
+
+
+@benchmark('AD9833.frequency_table')
+def _ad9833_frequency_table():
+    _, device = _ad98xx(AD9833)
+    freqs = np.linspace(0, 1e6, 10000)
+    return None, lambda: device.frequency_table(freqs), len(freqs)
+
+
+
+@benchmark('AD9833.play_trajectory')
+def _ad9833_play_trajectory():
+    bus, device = _ad98xx(AD9833)
+    trajectory = device.compile_trajectory(1e4 + 1e3 * np.sin(np.arange(10000) / 50), 1e9)
+    return bus, lambda: device.play_trajectory(trajectory), len(trajectory)
+
+
+
+@benchmark('ADF4351.set_frequency')
+def _adf4351_set_frequency():
+    bus = CountingBus()
+    device = ADF4351(bus)
+    freq = _alternate((1.5e9, 1.5002e9))
+    return bus, lambda: device.set_frequency(freq()), 1
+
+
+
+@benchmark('ADF4351.set_frequency_fast')
+def _adf4351_set_frequency_fast():
+    bus = CountingBus()
+    device = ADF4351(bus)
+    freqs = (1.5e9, 1.5002e9)
+    device.use_frequency_plan(FrequencyPlan.compile_for(device, freqs))
+    freq = _alternate(freqs)
+    return bus, lambda: device.set_frequency_fast(freq()), 1
+
+
+
+@benchmark('ADF4351.set_phase')
+def _adf4351_set_phase():
+    bus = CountingBus()
+    device = ADF4351(bus)
+    phase = _alternate((0, 90))
+    return bus, lambda: device.set_phase(phase()), 1
+
+
+
+@benchmark('ADF4351.reset')
+def _adf4351_reset():
+    bus = CountingBus()
+    device = ADF4351(bus)
+    return bus, device.reset, 1
+
+
+
+@benchmark('ADF4351.plan_frequencies')
+def _adf4351_plan_frequencies():
+    freqs = np.linspace(35e6, 4.4e9, 10000)
+    return None, lambda: plan_frequencies(freqs, 25e6, channel_resolution = 100e3), len(freqs)
+
+
+
+@benchmark('ADF4351.find_integer_n_plans')
+def _adf4351_find_integer_n_plans():
+    return None, lambda: find_integer_n_plans(1.5e9, 25e6), 1
+
+
+
+def run(setup, min_time = MIN_TIME, rounds = ROUNDS):
+    bus, operation, ops_per_call = setup()
+    best = 0
+
+    for _ in range(rounds):
+        n_calls = 0
+        t0 = time.perf_counter()
+        while True:
+            operation()
+            n_calls += 1
+            elapsed = time.perf_counter() - t0
+            if elapsed >= min_time:
+                break
+        best = max(best, n_calls * ops_per_call / elapsed)
+
+    result = {'ops_per_s': best}
+    if bus is not None:
+        bus.reset_counters()
+        operation()
+        result['transfers_per_op'] = bus.n_transfers / ops_per_call
+        result['bytes_per_op'] = bus.n_bytes / ops_per_call
+    return result
+
+
+
+def compare(results, baseline, threshold = THRESHOLD):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['ops_per_s'] / baseline[name]['ops_per_s']
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('{:<36s} {:>14.1f} ops/s  x{:0.2f}{}'.format(name, result['ops_per_s'], ratio, flag))
+    return regressions
+
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark drivers against an in-memory bus.')
+    parser.add_argument('-k', '--filter', default = '', help = 'only run benchmarks whose name contains this.')
+    parser.add_argument('--min-time', type = float, default = MIN_TIME)
+    parser.add_argument('--rounds', type = int, default = ROUNDS)
+    parser.add_argument('--save', help = 'write results to this JSON file.')
+    parser.add_argument('--compare', help = 'compare against results saved earlier with --save.')
+    parser.add_argument('--threshold', type = float, default = THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.filter in name:
+            results[name] = run(setup, min_time = args.min_time, rounds = args.rounds)
+            print('{:<36s} {:>14.1f} ops/s  {}'.format(name, results[name]['ops_per_s'],
+                                                      '{:0.1f} transfers/op'.format(results[name]['transfers_per_op'])
+                                                      if 'transfers_per_op' in results[name] else ''))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python'    : sys.version,
+                       'platform'  : platform.platform(),
+                       'time'      : time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'benchmarks': results}, f, indent = 2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['benchmarks']
+        print()
+        return 1 if compare(results, baseline, threshold = args.threshold) else 0
+
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())